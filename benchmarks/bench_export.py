@@ -0,0 +1,255 @@
+"""
+End-to-end benchmark of salsah2xml.py against the stand-in SALSAH server (see fake_salsah.py)
+
+Starts the stand-in server in a separate process, runs program of salsah2xml.py in this process and reports per
+pipeline stage the time, resources/sec, requests/sec and peak RSS. The stages are the ontology, the data (fetching,
+converting and writing the resources) and the wait for the image downloads at the end of the data stage. The peak
+RSS is the one of this process, worker processes (--processes) are not included.
+
+The data stage is broken down with the stages of {project}-metrics.json: ID paging, resource fetch, conversion,
+XML write, CSV write, output write and image download. Their time is summed over all workers, so the rates are
+per worker: requests/sec for the stages talking to the server, resources/sec for the others. Peak RSS is only
+known for the stages above.
+
+The results can be saved with --json and compared with a saved baseline with --baseline, which fails if the
+resources/sec of the data stage dropped by more than --tolerance.
+
+Usage: python benchmarks/bench_export.py [--resources 2000] [--latency 0.0] [--download] [-- salsah2xml options]
+Example: python benchmarks/bench_export.py --resources 5000 --latency 0.005 -- -w 8 --processes 2
+"""
+import argparse
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from time import perf_counter
+from typing import Callable, Dict, List
+
+import requests
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, ".."))
+
+import salsah2xml
+from salsah2xml import ImageDownloader, Salsah
+
+
+def get_rss() -> int:
+    """
+    :return: Current resident set size of this process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Without /proc only the peak of the whole run is known
+        import resource
+        factor = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * factor
+
+
+class StageRecorder:
+    """
+    Records time, requests to the server and peak RSS of the pipeline stages. The stages are found by wrapping
+    methods of salsah2xml, RSS is sampled by a background thread.
+    """
+
+    def __init__(self, server_url: str) -> None:
+        self.server_url: str = server_url
+        self.stages: Dict[str, Dict] = {}
+        self.active: Dict[str, Dict] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.running: bool = True
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def sample(self) -> None:
+        while self.running:
+            rss = get_rss()
+            with self.lock:
+                for stage in self.active.values():
+                    stage["peak_rss"] = max(stage["peak_rss"], rss)
+            time.sleep(0.005)
+
+    def get_requests(self) -> int:
+        return sum(requests.get(f"{self.server_url}/stats").json().values())
+
+    def wrap(self, owner: type, method_name: str, stage_name: str) -> None:
+        """
+        Replaces a method by a wrapper which records the time spent in it as stage
+        """
+        method: Callable = getattr(owner, method_name)
+        recorder = self
+
+        def wrapper(*args, **kwargs):
+            stage: Dict = {"requests": recorder.get_requests(), "peak_rss": get_rss(), "start": perf_counter()}
+            with recorder.lock:
+                recorder.active[stage_name] = stage
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - stage["start"]
+                with recorder.lock:
+                    del recorder.active[stage_name]
+                recorder.stages[stage_name] = {
+                    "seconds": seconds,
+                    "requests": recorder.get_requests() - stage["requests"],
+                    "peak_rss": max(stage["peak_rss"], get_rss())
+                }
+
+        setattr(owner, method_name, wrapper)
+
+    def stop(self) -> None:
+        self.running = False
+        self.sampler.join()
+
+
+# Stages of the metrics which count requests to the server, all others count resources
+request_stages: List[str] = ["ontology", "id paging", "resource fetch", "image download"]
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(resources: int, latency: float, error_rate: float) -> (subprocess.Popen, str):
+    port = get_free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(benchmarks_path, "fake_salsah.py"), "--port", str(port),
+                               "--resources", str(resources), "--latency", str(latency),
+                               "--error-rate", str(error_rate)], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/reset")
+            return server, url
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("The stand-in server did not start")
+
+
+def run(resources: int, latency: float, error_rate: float, download: bool, options: List[str],
+        show_output: bool) -> Dict:
+    """
+    Runs one export against a new stand-in server
+
+    :return: Results per stage
+    """
+    server, url = start_server(resources, latency, error_rate)
+    recorder = StageRecorder(url)
+    recorder.wrap(Salsah, "get_ontology", "ontology")
+    recorder.wrap(Salsah, "get_data", "data")
+    recorder.wrap(ImageDownloader, "close", "image downloads (wait)")
+
+    args = [url, "-u", "user", "-p", "password", "-P", "test", "-s", "0001", "-F", "out"] + options
+    if download:
+        args.append("-d")
+
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            output = None if show_output else open(os.devnull, "w")
+            with contextlib.redirect_stdout(output) if output is not None else contextlib.nullcontext():
+                start = perf_counter()
+                salsah2xml.program(args)
+                seconds = perf_counter() - start
+
+            # Every resource written to the data XML is counted in the metrics, duplicates and unchanged
+            # resources are not
+            metrics_filename = [name for name in os.listdir(os.path.join(folder, "out"))
+                                if name.startswith("test-metrics.json")][0]
+            with salsah2xml.open_input(os.path.join(folder, "out", metrics_filename)) as f:
+                metrics = json.load(f)["stages"]
+            exported = metrics["xml write"]["calls"]
+    finally:
+        os.chdir(cwd)
+        recorder.stop()
+        server.terminate()
+        server.wait()
+
+    stages: Dict = recorder.stages
+    stages["total"] = {
+        "seconds": seconds,
+        "requests": sum(stage["requests"] for name, stage in stages.items() if name in ("ontology", "data")),
+        "peak_rss": max(stage["peak_rss"] for stage in stages.values())
+    }
+    for name, stage in stages.items():
+        if name in ("data", "total"):
+            stage["resources"] = exported
+            stage["resources_per_sec"] = exported / stage["seconds"]
+        stage["requests_per_sec"] = stage["requests"] / stage["seconds"]
+
+    for name, stage in metrics.items():
+        unit = "requests_per_sec" if name in request_stages else "resources_per_sec"
+        stage[unit] = stage["calls"] / stage["seconds"] if stage["seconds"] else 0.0
+
+    return {"resources": resources, "latency": latency, "download": download, "options": options,
+            "stages": stages, "metrics": metrics}
+
+
+def print_results(results: Dict) -> None:
+    print(f"{results['resources']} resources, latency {results['latency']}s, "
+          f"options: {' '.join(results['options']) or '-'}{' -d' if results['download'] else ''}")
+    print(f"{'stage':<24}{'seconds':>10}{'resources/s':>14}{'requests/s':>13}{'peak RSS MB':>14}")
+    for name, stage in results["stages"].items():
+        resources_per_sec = f"{stage['resources_per_sec']:.0f}" if "resources_per_sec" in stage else "-"
+        print(f"{name:<24}{stage['seconds']:>10.2f}{resources_per_sec:>14}{stage['requests_per_sec']:>13.0f}"
+              f"{stage['peak_rss'] / 1024 / 1024:>14.1f}")
+
+    print()
+    print(f"{'stage (per worker)':<24}{'seconds':>10}{'resources/s':>14}{'requests/s':>13}{'calls':>8}"
+          f"{'MB':>8}{'errors':>8}")
+    for name, stage in results["metrics"].items():
+        resources_per_sec = f"{stage['resources_per_sec']:.0f}" if "resources_per_sec" in stage else "-"
+        requests_per_sec = f"{stage['requests_per_sec']:.0f}" if "requests_per_sec" in stage else "-"
+        print(f"{name:<24}{stage['seconds']:>10.2f}{resources_per_sec:>14}{requests_per_sec:>13}"
+              f"{stage['calls']:>8}{stage['bytes'] / 1024 / 1024:>8.1f}{stage['errors']:>8}")
+
+
+def main() -> None:
+    argv = sys.argv[1:]
+    options: List[str] = []
+    if "--" in argv:
+        options = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of salsah2xml.py")
+    parser.add_argument("--resources", type=int, default=2000, help="Number of resources of the stand-in project")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay of every response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the requests answered with 503")
+    parser.add_argument("--download", action="store_true", help="Download the image files")
+    parser.add_argument("--output", action="store_true", help="Show the output of salsah2xml.py")
+    parser.add_argument("--json", help="Save the results to a JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed drop of the resources/sec of the data stage against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.resources, args.latency, args.error_rate, args.download, options, args.output)
+    print_results(results)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        before = baseline["stages"]["data"]["resources_per_sec"]
+        after = results["stages"]["data"]["resources_per_sec"]
+        print(f"data stage: {after:.0f} resources/s, baseline {before:.0f} resources/s ({after / before - 1:+.1%})")
+        if after < before * (1 - args.tolerance):
+            print(f"Regression: more than {args.tolerance:.0%} slower than the baseline")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for Salsah.process_value
+
+Converts a fixed mix of values (text, rich text, dates, lists, resource pointers, numbers) over and over and
+prints the number of values converted per second.
+
+Usage: python benchmarks/bench_process_value.py [number of values]
+"""
+import json
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from salsah2xml import Salsah, ValtypeMap
+
+
+def get_values() -> list:
+    rich_text = "The first <b>movement</b> of the quartet, sketched in 1925 & revised later"
+    rich_text_attr = json.dumps({
+        "bold": [{"start": 4, "end": 9}],
+        "italic": [{"start": 10, "end": 18}],
+        "_link": [{"start": 26, "end": 33, "resid": "4711"}]
+    })
+    return [
+        (ValtypeMap.TEXT.value, "Letter to Alban Berg"),
+        (ValtypeMap.TEXT.value, "Sketch \"Op. 28\" <draft>"),
+        (ValtypeMap.RICHTEXT.value, {"utf8str": rich_text, "textattr": rich_text_attr, "resource_reference": ["4711"], "resptrs": []}),
+        (ValtypeMap.DATE.value, {"calendar": "GREGORIAN", "dateval1": "2424152", "dateval2": "2424152", "dateprecision1": "DAY", "dateprecision2": "DAY"}),
+        (ValtypeMap.DATE.value, {"calendar": "JULIAN", "dateval1": "2299161", "dateval2": "2299525", "dateprecision1": "YEAR", "dateprecision2": "YEAR"}),
+        (ValtypeMap.SELECTION.value, "6615"),
+        (ValtypeMap.HLIST.value, "8812"),
+        (ValtypeMap.RESPTR.value, "123456"),
+        (ValtypeMap.INTEGER.value, "42"),
+        (ValtypeMap.FLOAT.value, "3.1415"),
+        (ValtypeMap.COLOR.value, "#ff0000"),
+        (ValtypeMap.GEONAME.value, "2661552"),
+    ]
+
+
+def main() -> None:
+    n_values = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    con = Salsah(server="", user="", password="", filename="", assets_path="", images_path="", projectname="webern",
+                 shortcode="0806", resptrs={}, permissions={}, session=None)
+
+    values = get_values()
+    rounds = n_values // len(values)
+
+    start = perf_counter()
+    for _ in range(rounds):
+        for counter, (val_type, value) in enumerate(values, 1):
+            con.process_value(val_type, value, counter)
+    elapsed = perf_counter() - start
+
+    print(f"{rounds * len(values)} values in {elapsed:.2f}s: {rounds * len(values) / elapsed:.0f} values/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Stand-in for a SALSAH server, which serves a synthetic project for benchmarks
+
+The project "test" has N resources: every fifth resource is a person with an image file, the others are books with
+text, rich text (markup and links), dates, selections, hierarchical lists, resource pointers and numbers. The
+resources are generated from their id, so every run gets the same data. The number of requests per endpoint can be
+read with /stats and cleared with /reset.
+
+Usage: python benchmarks/fake_salsah.py [--port 8765] [--resources 1000] [--latency 0.0] [--error-rate 0.0]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+
+def get_label(label: str) -> List[Dict]:
+    return [{"shortname": "en", "label": label}, {"shortname": "de", "label": f"{label} (de)"}]
+
+
+def get_property(name: str, php_constant: str, gui_name: str, occurrence: str, attributes: str = None,
+                 vocabulary: str = "test") -> Dict:
+    return {
+        "name": name,
+        "vocabulary": vocabulary,
+        "vt_php_constant": php_constant,
+        "gui_name": gui_name,
+        "occurrence": occurrence,
+        "attributes": attributes,
+        "label": get_label(name.replace("_", " ").title())
+    }
+
+
+resourcetypes: Dict = {
+    "1": {
+        "name": "test:book",
+        "class": "object",
+        "label": get_label("Book"),
+        "description": [{"shortname": "en", "description": "A book"}],
+        "properties": [
+            get_property("title", "VALTYPE_TEXT", "text", "1", "size=60;maxlength=255"),
+            get_property("description", "VALTYPE_RICHTEXT", "richtext", "0-n"),
+            get_property("pubdate", "VALTYPE_DATE", "date", "0-1"),
+            get_property("category", "VALTYPE_SELECTION", "pulldown", "0-n", "selection=1"),
+            get_property("topic", "VALTYPE_HLIST", "hlist", "0-n", "hlist=2"),
+            get_property("author", "VALTYPE_RESPTR", "searchbox", "0-n", "restypeid=2;numprops=2"),
+            get_property("pages", "VALTYPE_INTEGER", "spinbox", "0-1"),
+            get_property("title", "VALTYPE_TEXT", "text", "0-1", vocabulary="dc")
+        ]
+    },
+    "2": {
+        "name": "test:person",
+        "class": "image",
+        "label": get_label("Person"),
+        "properties": [
+            get_property("has_name", "VALTYPE_TEXT", "text", "1"),
+            get_property("__location__", "VALTYPE_TEXT", "text", "0-1", vocabulary="salsah")
+        ]
+    }
+}
+
+selections: List[Dict] = [{"id": "1", "name": "categories", "label": get_label("Categories")}]
+
+selection_nodes: Dict = {
+    "1": [
+        {"id": "11", "name": "novel", "label": get_label("Novel")},
+        {"id": "12", "name": "poem", "label": get_label("Poem")},
+        {"id": "13", "name": "letter", "label": get_label("Letter")}
+    ]
+}
+
+hlists: List[Dict] = [{"id": "2", "name": "topics", "label": get_label("Topics")}]
+
+hlist_nodes: Dict = {
+    "2": [
+        {"id": "21", "name": "science", "label": get_label("Science"), "children": [
+            {"id": "22", "name": "physics", "label": get_label("Physics")},
+            {"id": "24", "name": "biology", "label": get_label("Biology")}
+        ]},
+        {"id": "23", "name": "art", "label": get_label("Art")}
+    ]
+}
+
+words: List[str] = ["alpha", "beta", "gamma", "delta", "epsilon", "sketch", "letter", "movement", "quartet", "1925",
+                    "revised", "&", "<draft>", "\"Op. 28\""]
+
+
+class FakeSalsah:
+    """
+    Synthetic project served by the stand-in server
+    """
+
+    def __init__(self, base_url: str, resources: int, latency: float = 0.0, error_rate: float = 0.0,
+                 image_size: int = 20000) -> None:
+        """
+        :param base_url: URL of the server, used for the image locations
+        :param resources: Number of resources of the project
+        :param latency: Delay of every response in seconds
+        :param error_rate: Share of the requests answered with 503
+        :param image_size: Size of the image files in bytes
+        """
+        self.base_url: str = base_url
+        self.resources: int = resources
+        self.latency: float = latency
+        self.error_rate: float = error_rate
+        self.image_size: int = image_size
+        self.requests: Dict[str, int] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def get_rich_text(self, rnd: random.Random) -> Dict:
+        text = " ".join(rnd.choice(words) for _ in range(rnd.randint(5, 60)))
+        attributes: Dict = {}
+        if rnd.random() < 0.8:
+            length = len(text)
+            a = rnd.randint(0, length // 2)
+            b = rnd.randint(a, length)
+            c = rnd.randint(a, b)
+            attributes = {
+                "bold": [{"start": a, "end": b}],
+                "italic": [{"start": c, "end": rnd.randint(b, length)}],
+                "linebreak": [{"start": b, "end": b}],
+                "_link": [{"start": a, "end": c, "resid": str(rnd.randint(1, self.resources))}]
+            }
+            if rnd.random() < 0.5:
+                attributes["p"] = [{"start": 0, "end": length}]
+        return {
+            "utf8str": text,
+            "textattr": json.dumps(attributes),
+            "resource_reference": [attributes["_link"][0]["resid"]] if attributes else [],
+            "resptrs": []
+        }
+
+    def get_resource(self, res_id: int) -> Dict:
+        rnd = random.Random(res_id)
+
+        if res_id % 5 == 0:
+            name = f"Person <{res_id}>"
+            return {
+                "status": 0,
+                "resdata": {"res_id": str(res_id), "restype_name": "test:person"},
+                "resinfo": {
+                    "handle_id": f"ark:/72163/{res_id}",
+                    "firstproperty": name,
+                    "locdata": {"origname": f"img{res_id}.jpg", "path": f"{self.base_url}/img/{res_id}?qtype=full"}
+                },
+                "props": {
+                    "test:has_name": {"valuetype_id": "1", "values": [name], "comments": [None]},
+                    "__location__": {"valuetype_id": "1", "values": [], "comments": []}
+                }
+            }
+
+        title = f"Title \"{res_id}\" <b>"
+        n_categories = rnd.randint(0, 3)
+        n_descriptions = rnd.randint(1, 3)
+        dateval1 = 2451545 + rnd.randint(-800000, 100000)
+        return {
+            "status": 0,
+            "resdata": {"res_id": str(res_id), "restype_name": "test:book"},
+            "resinfo": {"firstproperty": title},
+            "props": {
+                "test:title": {"valuetype_id": "1", "values": [title],
+                               "comments": ["a comment" if res_id % 7 == 0 else None]},
+                "test:description": {"valuetype_id": "14",
+                                     "values": [self.get_rich_text(rnd) for _ in range(n_descriptions)],
+                                     "comments": [None] * n_descriptions},
+                "test:pubdate": {"valuetype_id": "4", "values": [{
+                    "calendar": rnd.choice(["GREGORIAN", "JULIAN"]),
+                    "dateval1": str(dateval1),
+                    "dateval2": str(dateval1 + rnd.choice([0, 0, 30, 400])),
+                    "dateprecision1": rnd.choice(["YEAR", "MONTH", "DAY"]),
+                    "dateprecision2": rnd.choice(["YEAR", "MONTH", "DAY"])
+                }], "comments": [None]},
+                "test:category": {"valuetype_id": "7", "values": [str(11 + k % 3) for k in range(n_categories)],
+                                  "comments": [None] * n_categories, "attributes": "selection=1"},
+                "test:topic": {"valuetype_id": "12", "values": [rnd.choice(["22", "23", "24"])], "comments": [None],
+                               "attributes": "hlist=2"},
+                "test:author": {"valuetype_id": "6", "values": [str(5 * rnd.randint(1, max(1, self.resources // 5)))],
+                                "comments": [None]},
+                "test:pages": {"valuetype_id": "2", "values": [str(rnd.randint(1, 900))], "comments": [None]},
+                "dc:title": {"valuetype_id": "1", "values": [f"dc {res_id}"], "comments": [None]}
+            }
+        }
+
+    def get_image(self, res_id: int) -> bytes:
+        return bytes((res_id * k) % 256 for k in range(self.image_size))
+
+    def get_api(self, parts: List[str], query: Dict[str, str]) -> Dict:
+        """
+        :param parts: Path after /api
+        :param query: Query parameters
+        :return: Response of the SALSAH API
+        """
+        endpoint = parts[0]
+
+        if endpoint == "vocabularies":
+            if parts[1:] == ["0"]:
+                return {"status": 0, "vocabularies": [
+                    {"shortname": "salsah", "uri": "http://www.salsah.org/ontology/salsah#"},
+                    {"shortname": "dc", "uri": "http://purl.org/dc/"}
+                ]}
+            return {"status": 0, "vocabularies": [
+                {"shortname": "salsah", "project_id": "0"},
+                {"shortname": "test", "project_id": "4"}
+            ]}
+        if endpoint == "projects":
+            return {"status": 0, "project_info": {"shortname": "test", "longname": "Test project",
+                                                  "description": [{"shortname": "en", "description": "Benchmark"}],
+                                                  "keywords": "benchmark, test"}}
+        if endpoint == "resourcetypes":
+            if len(parts) == 1:
+                return {"status": 0, "resourcetypes": [{"id": restype_id} for restype_id in resourcetypes]}
+            return {"status": 0, "restype_info": resourcetypes[parts[1]]}
+        if endpoint == "selections":
+            if len(parts) == 1:
+                return {"status": 0, "selections": selections}
+            return {"status": 0, "selection": selection_nodes[parts[1]]}
+        if endpoint == "hlists":
+            if len(parts) == 1:
+                return {"status": 0, "hlists": hlists}
+            return {"status": 0, "hlist": hlist_nodes[parts[1]]}
+        if endpoint == "search":
+            start = int(query.get("start_at", 0))
+            n_rows = int(query.get("show_nrows", 25))
+            res_ids = range(start + 1, min(start + n_rows, self.resources) + 1)
+            return {"status": 0, "nhits": str(self.resources), "subjects": [{"obj_id": str(i)} for i in res_ids]}
+        if endpoint == "resources":
+            resource = self.get_resource(int(parts[1]))
+            if query.get("reqtype") == "info":
+                return {"status": 0, "resource_info": {"firstproperty": resource["resinfo"]["firstproperty"]}}
+            return resource
+
+        return {"status": 1, "errormsg": f"Unknown endpoint '{endpoint}'"}
+
+
+class FakeSalsahHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, with Nagle's algorithm every response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send(self, body: bytes, content_type: str = "application/json") -> None:
+        status = 200
+        headers: Dict = {"Content-Type": content_type}
+
+        # Answers range requests of image files, which are used to resume downloads
+        range_header = self.headers.get("Range")
+        if range_header is not None and content_type != "application/json":
+            start = int(range_header.split("=")[1].split("-")[0])
+            headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            body = body[start:]
+            status = 206
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self) -> None:
+        # Answered like GET, send leaves out the body
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        fake: FakeSalsah = self.server.fake
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+
+        if parts[0] == "stats":
+            return self.send(json.dumps(fake.requests).encode("utf-8"))
+        if parts[0] == "reset":
+            with fake.lock:
+                fake.requests.clear()
+            return self.send(b"{}")
+
+        endpoint = parts[1] if parts[0] == "api" and len(parts) > 1 else parts[0]
+        fake.count(endpoint + (" info" if query.get("reqtype") == "info" else ""))
+
+        if fake.latency > 0:
+            time.sleep(fake.latency)
+        if fake.error_rate > 0 and random.random() < fake.error_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if parts[0] == "img":
+            return self.send(fake.get_image(int(parts[1])), "image/jpeg")
+        if parts[0] == "api" and len(parts) > 1:
+            return self.send(json.dumps(fake.get_api(parts[1:], query)).encode("utf-8"))
+
+        self.send(json.dumps({"status": 1, "errormsg": "Unknown path"}).encode("utf-8"))
+
+
+def start_server(port: int, resources: int, latency: float = 0.0, error_rate: float = 0.0,
+                 image_size: int = 20000) -> ThreadingHTTPServer:
+    """
+    Starts the stand-in server in a background thread
+
+    :return: Server, stop it with shutdown()
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeSalsahHandler)
+    server.daemon_threads = True
+    server.fake = FakeSalsah(f"http://127.0.0.1:{server.server_address[1]}", resources, latency, error_rate,
+                             image_size)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stand-in for a SALSAH server with a synthetic project 'test'")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--resources", type=int, default=1000, help="Number of resources of the project")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay of every response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the requests answered with 503")
+    parser.add_argument("--image-size", type=int, default=20000, help="Size of the image files in bytes")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.resources, args.latency, args.error_rate, args.image_size)
+    print(f"Serving {args.resources} resources on {server.fake.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,55 @@
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
+from itertools import count
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from operator import itemgetter
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener
 from lxml import etree
 from re import sub, search
-from typing import List, Dict, Tuple
+from time import perf_counter
+from typing import List, Dict, Tuple, Callable, Iterable, Iterator
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
 from datetime import datetime
 import argparse
+import atexit
+import bisect
+import gzip
+import hashlib
+import heapq
 import jdcal
 import json
+import logging
+import lzma
 import magic
+import mmap
+import multiprocessing
 import os
+import random
+import re
 import requests
 import shutil
+import sqlite3
 import sys
+import threading
 import csv
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 requests.urllib3.disable_warnings(requests.urllib3.exceptions.InsecureRequestWarning)
 
 #
@@ -117,46 +154,367 @@ etags: Dict = {
     "h6": "</h6>"
 }
 
-allResAdded: Dict
+# Timeouts (connect, read) in seconds per endpoint of the SALSAH API, "download" is used for image files
+endpoint_timeouts: Dict = {
+    "default": (10, 60),
+    "search": (10, 300),
+    "download": (10, 600)
+}
+
+# Level of the messages which report a finished step
+SUCCESS: int = 25
+logging.addLevelName(SUCCESS, "SUCCESS")
+
+logger: logging.Logger = logging.getLogger("salsah2xml")
+# Messages per value, which can be sampled with --log-sample
+value_logger: logging.Logger = logging.getLogger("salsah2xml.values")
+
+# Listeners writing the queued messages to the output (of this process and of the worker processes), see setup_logging
+log_listeners: List[QueueListener] = []
+
+
+class ConsoleFormatter(logging.Formatter):
+    """
+    Formats messages like "[12:00:00] WARNING: message", with colors for the terminal
+    """
+
+    tags: Dict[int, Tuple[str, str]] = {
+        logging.DEBUG: ("LOG:", Colors.BLUE),
+        SUCCESS: ("SUCCESS:", Colors.GREEN),
+        logging.WARNING: ("WARNING:", Colors.ORANGE),
+        logging.ERROR: ("ERROR:", Colors.RED)
+    }
+
+    def __init__(self, colors: bool = True) -> None:
+        super().__init__()
+        self.colors: bool = colors
+
+    def color(self, text: str, color: str) -> str:
+        return f"{color}{text}{Colors.END}" if self.colors else text
 
-max_values = 0
+    def format(self, record: logging.LogRecord) -> str:
+        message = f"[{self.color(datetime.fromtimestamp(record.created).strftime('%H:%M:%S'), Colors.GREY)}] "
+        if record.levelno in self.tags:
+            message += self.color(*self.tags[record.levelno]) + " "
+        message += record.getMessage()
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
 
 
-def time():
-    return f"[{Colors.GREY}{datetime.now().strftime('%H:%M:%S')}{Colors.END}]"
+class JsonFormatter(logging.Formatter):
+    """
+    Formats messages as JSON lines with time, level, logger and message. The fields given with extra= are added.
+    """
 
+    # Attributes of every record, the other attributes were given with extra=
+    standard_fields = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
 
-def success():
-    return f"{Colors.GREEN}SUCCESS:{Colors.END}"
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.standard_fields:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
 
 
-def log():
-    return f"{Colors.BLUE}LOG:{Colors.END}"
+class LocalQueueHandler(QueueHandler):
+    """
+    Puts the messages unformatted into a queue of this process, so they are formatted by the listener thread
+    """
 
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
-def warning():
-    return f"{Colors.ORANGE}WARNING:{Colors.END}"
 
+class SamplingFilter(logging.Filter):
+    """
+    Lets one in n messages pass
+    """
+
+    def __init__(self, n: int) -> None:
+        super().__init__()
+        self.n: int = n
+        self.counter: Iterator[int] = count()
 
-def error():
-    return f"{Colors.RED}ERROR:{Colors.END}"
+    def filter(self, record: logging.LogRecord) -> bool:
+        return next(self.counter) % self.n == 0
 
 
-def save(file_name, data):
+def configure_loggers(handler: logging.Handler, level: int, sample: int) -> None:
+    """
+    Sends the messages of the loggers to the handler, which only puts them into a queue. Formatting and writing
+    is done by a listener in a background thread.
+
+    :param handler: Queue handler
+    :param level: Minimal level of the messages
+    :param sample: Only one in sample messages per value is logged
+    """
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    value_logger.filters.clear()
+    if sample > 1:
+        value_logger.addFilter(SamplingFilter(sample))
+
+
+def setup_logging(level: int = logging.INFO, log_format: str = "text", log_file: str = None,
+                  sample: int = 1) -> None:
+    """
+    Sets up the logging of the export
+
+    :param level: Minimal level of the messages
+    :param log_format: "text" or "json" (one JSON object per line)
+    :param log_file: Writes the messages to this file instead of stdout
+    :param sample: Only one in sample messages per value is logged
+    """
+    stop_logging()
+
+    if log_file is None:
+        output: logging.Handler = logging.StreamHandler(sys.stdout)
+    else:
+        output = logging.FileHandler(log_file, encoding="utf-8")
+    output.setFormatter(JsonFormatter() if log_format == "json" else ConsoleFormatter(colors=log_file is None))
+
+    log_queue: SimpleQueue = SimpleQueue()
+    configure_loggers(LocalQueueHandler(log_queue), level, sample)
+    listener = QueueListener(log_queue, output)
+    listener.start()
+    log_listeners.append(listener)
+
+
+def add_log_listener(log_queue) -> QueueListener:
+    """
+    Writes the messages which worker processes put into the queue to the output of this process
+
+    :param log_queue: Queue shared with the worker processes
+    :return: Started listener, which has to be stopped when the worker processes are done
+    """
+    output = log_listeners[0].handlers if log_listeners else (logging.StreamHandler(sys.stdout),)
+    listener = QueueListener(log_queue, *output)
+    listener.start()
+    return listener
+
+
+def stop_logging() -> None:
+    """
+    Writes the queued messages and stops the listeners
+    """
+    while log_listeners:
+        listener = log_listeners.pop()
+        listener.stop()
+        for handler in listener.handlers:
+            handler.flush()
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+
+
+atexit.register(stop_logging)
+
+
+# Endings and magic numbers of the compressed output files
+compressions: Dict[str, Tuple[str, bytes]] = {
+    "gzip": (".gz", b"\x1f\x8b"),
+    "xz": (".xz", b"\xfd7zXZ\x00"),
+    "zstd": (".zst", b"\x28\xb5\x2f\xfd")
+}
+
+
+def compressed_filename(filename: str, compression: str = None) -> str:
+    """
+    :param filename: Name of the uncompressed file
+    :param compression: gzip, xz, zstd or None
+    :return: Name of the file with the ending of the compression
+    """
+    if compression is None:
+        return filename
+    return filename + compressions[compression][0]
+
+
+def open_output(filename: str, mode: str = "w", compression: str = None, **kwargs):
+    """
+    Opens a file for writing, which is compressed on the fly while it is written
+
+    :param filename: Name of the file, see compressed_filename
+    :param mode: Mode as for open, e.g. "w" or "wb"
+    :param compression: gzip, xz, zstd or None
+    :param kwargs: Further arguments for text files, e.g. encoding and newline
+    :return: File object
+    """
+    if compression is None:
+        return open(filename, mode, **kwargs)
+
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    if compression == "gzip":
+        return gzip.open(filename, mode, **kwargs)
+    if compression == "xz":
+        return lzma.open(filename, mode, **kwargs)
+    if compression == "zstd":
+        if zstandard is None:
+            raise SalsahError("SALSAH-ERROR:\nThe zstd compression needs the package 'zstandard'")
+        return zstandard.open(filename, mode, **kwargs)
+    raise SalsahError(f"SALSAH-ERROR:\nUnknown compression '{compression}'")
+
+
+def open_input(filename: str, mode: str = "r", **kwargs):
+    """
+    Opens a file for reading. Files compressed with gzip, xz or zstd are decompressed transparently, the
+    compression is recognized by the first bytes of the file.
+
+    :param filename: Name of the file
+    :param mode: Mode as for open, e.g. "r" or "rb"
+    :param kwargs: Further arguments for text files, e.g. encoding
+    :return: File object
+    """
+    with open(filename, "rb") as f:
+        head = f.read(6)
+
+    for compression, (_, magic_number) in compressions.items():
+        if head.startswith(magic_number):
+            if "b" not in mode and "t" not in mode:
+                mode += "t"
+            if compression == "gzip":
+                return gzip.open(filename, mode, **kwargs)
+            if compression == "xz":
+                return lzma.open(filename, mode, **kwargs)
+            if zstandard is None:
+                raise SalsahError(f"SALSAH-ERROR:\n{filename} is compressed with zstd, which needs the package 'zstandard'")
+            return zstandard.open(filename, mode, **kwargs)
+
+    return open(filename, mode, **kwargs)
+
+
+def save(file_name, data, compression: str = None):
     """
     Writes the data into a json file
 
     :param file_name: Name must include ending. Ex. 'output.json'
     :param data:
+    :param compression: Compresses the file with gzip, xz or zstd, the ending is appended to the name
     """
     try:
-        with open(file_name, "w") as outfile:
+        with open_output(compressed_filename(file_name, compression), "w", compression) as outfile:
             json.dump(data, outfile)
     except Exception:
-        print(f"{error()} File {file_name} couldn't be opened")
+        logger.error("File %s couldn't be opened", file_name)
         raise SystemExit(0)
 
 
+def ordered_map(func: Callable, items: Iterable, workers: int = 1, window: int = None, executor: Executor = None) -> Iterator:
+    """
+    Applies func to every item and yields the results in the order of the items. With more than one worker
+    the calls run in a thread pool, but never more than 'window' calls are pending at the same time. The
+    items are consumed lazily, so a slow consumer holds back the producer instead of piling up results.
+
+    :param func: Function to apply to every item
+    :param items: Iterable with the arguments for func
+    :param workers: Number of threads, 1 runs everything in the calling thread
+    :param window: Maximum number of pending calls (default: twice the number of workers)
+    :param executor: Executor to run the calls in (e.g. a process pool) instead of a new thread pool
+    :return: Iterator over the results in the same order as the items
+    """
+    if window is None:
+        window = 2 * workers
+
+    if executor is not None:
+        yield from map_window(executor, func, items, window)
+        return
+
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from map_window(executor, func, items, window)
+
+
+def map_window(executor: Executor, func: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    Submits the calls of func for the items to the executor, keeping at most 'window' calls pending
+
+    :return: Iterator over the results in the same order as the items
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+    finally:
+        # Drops the calls which did not start yet if the consumer stops early or an error occurred
+        for future in pending:
+            future.cancel()
+
+
+@lru_cache(maxsize=65536)
+def format_date(calendar: str, dateval1: str, dateval2: str, precision1: str, precision2: str) -> str:
+    """
+    Formats a date of SALSAH (two Julian day numbers with a calendar and precisions) as a DSP date string.
+    The results are cached, since archival projects repeat the same dates over and over.
+
+    :param calendar: GREGORIAN or JULIAN
+    :param dateval1: Julian day number of the start
+    :param dateval2: Julian day number of the end
+    :param precision1: Precision of the start (YEAR, MONTH or DAY)
+    :param precision2: Precision of the end (YEAR, MONTH or DAY)
+    :return: Date string, e.g. "GREGORIAN:CE:1925-03-01:CE:1925-03-02"
+    """
+    cal: str
+    start: Tuple[int, int, int, float]
+    end: Tuple[int, int, int, float]
+    if calendar == "GREGORIAN":
+        cal = "GREGORIAN"
+        start = jdcal.jd2gcal(float(dateval1), 0.0)
+        end = jdcal.jd2gcal(float(dateval2), 0.0)
+    else:
+        cal = "JULIAN"
+        start = jdcal.jd2jcal(float(dateval1), 0.0)
+        end = jdcal.jd2jcal(float(dateval2), 0.0)
+    p1: str = "CE"
+    if start[0] <= 0:
+        start = (start[0] - 1, start[1], start[2], start[3])
+        p1 = "BCE"
+
+    p2: str = "CE"
+    if end[0] <= 0:
+        end = (end[0] - 1, end[1], end[2], end[3])
+        p2 = "BCE"
+
+    startstr: str = ""
+    endstr: str = ""
+
+    if precision1 == "YEAR":
+        startstr = "{}:{}:{:04d}".format(cal, p1, start[0])
+    elif precision1 == "MONTH":
+        startstr = "{}:{}:{:04d}-{:02d}".format(cal, p1, start[0], start[1])
+    else:
+        startstr = "{}:{}:{:04d}-{:02d}-{:02d}".format(cal, p1, start[0], start[1], start[2])
+
+    if precision2 == "YEAR":
+        if start[0] != end[0]:
+            endstr = ":{}:{:04d}".format(p2, end[0])
+    elif precision2 == "MONTH":
+        if start[0] != end[0] or start[1] != end[1]:
+            endstr = ":{}:{:04d}-{:02d}".format(p2, end[0], end[1])
+    else:
+        if start[0] != end[0] or start[1] != end[1] or start[2] != end[2]:
+            endstr = ":{}:{:04d}-{:02d}-{:02d}".format(p2, end[0], end[1], end[2])
+
+    return f"{startstr}{endstr}"
+
+
 def camel_case(str: str, first_letter_case=None) -> str:
     """
     Helper function to transform a given string str to camelCase.
@@ -217,98 +575,1374 @@ def upper_camel_case(s: str) -> str:
     return camel_case(s, "upper")
 
 
+def get_start_tag(tagname: str, attr: Dict, projectname: str) -> str:
+    """
+    Renders the start tag of a rich text markup
+
+    :param tagname: Name of the markup in SALSAH
+    :param attr: Attributes of the markup (start, end, href, resid, style)
+    :param projectname: Name of the project, used for links to other resources
+    :return: Start tag
+    """
+    if tagname == "_link":
+        if attr.get("resid"):
+            return stags[tagname][1].format(projectname + "_" + attr["resid"])
+        elif attr.get("href"):
+            return stags[tagname][0].format(attr["href"].replace("\"", "'"))
+        else:
+            return stags[tagname][2]
+    return stags[tagname]
+
+
 def process_rich_text(utf8str: str, projectname: str, textattr: str = None, resptrs: List = []) -> (str, str):
-    if textattr is not None and textattr != "{}":
+    if textattr is None or textattr == "{}":
+        # Not the best solution. All "<" and ">" are eliminated so at the end it is valid
+        return "xml", utf8str.replace("<", "").replace(">", "")
 
-        attributes = json.loads(textattr)
-        if len(attributes) == 0:
-            return "utf8", utf8str
+    attributes = json.loads(textattr)
+    if len(attributes) == 0:
+        return "utf8", utf8str
+
+    # Collects the markers as (position, start tag, tag name). End markers have no start tag.
+    # The sort is stable, so markers at the same position keep the order of the attributes.
+    markers: List = []
+    for tagname, vals in attributes.items():
+        for val in vals:
+            markers.append((int(val["start"]), get_start_tag(tagname, val, projectname), tagname))
+            markers.append((val["end"], None, tagname))
+    markers.sort(key=itemgetter(0))
+
+    # The text segments only have to be cleaned if there is something to remove
+    clean: bool = "<" in utf8str or ">" in utf8str
+    parts: List[str] = []
+    # Open tags as (tag name, start tag)
+    stack: List = []
+    pos: int = 0
+
+    for marker_pos, start_tag, tagname in markers:
+        segment = utf8str[pos:marker_pos]
+        if clean:
+            segment = segment.replace("<", "").replace(">", "")
+        parts.append(segment)
+
+        if start_tag is not None:
+            parts.append(start_tag)
+            stack.append((tagname, start_tag))
+        else:
+            # Finds the matching start tag, closes all tags above it and reopens them to keep the markup nested
+            match = len(stack) - 1
+            while match >= 0 and stack[match][0] != tagname:
+                match -= 1
+            if match < 0:
+                raise SalsahError(f"SALSAH-ERROR:\nEnd of '{tagname}' at position {marker_pos} has no start")
 
-        attrlist: List = []
+            for i in range(len(stack) - 1, match - 1, -1):
+                parts.append(etags[stack[i][0]])
+            for i in range(match + 1, len(stack)):
+                parts.append(stack[i][1])
+            del stack[match]
 
-        for key, vals in attributes.items():
-            for val in vals:
-                attr: Dict = {
-                    "tagname": key,
-                    "type": "start",
-                    "pos": int(val["start"])
-                }
+        pos = marker_pos
 
-                if val.get("href"):
-                    attr["href"] = val["href"].replace("\"", "'")
-                if val.get("resid"):
-                    attr["resid"] = val["resid"]
-                if val.get("style"):
-                    attr["style"] = val["style"]
-
-                attrlist.append(attr)
-                attr = {
-                    "tagname": key,
-                    "type": "end",
-                    "pos": val["end"]
-                }
-                attrlist.append(attr)
-
-        attrlist = sorted(attrlist, key=lambda attr: attr["pos"])
-        pos: int = 0
-        result: str = ""
-        stack: List = []
-
-        for attr in attrlist:
-            result += utf8str[pos:attr["pos"]].replace("<", "").replace(">", "")
-            if attr["type"] == "start":
-                if attr["tagname"] == "_link":
-                    if attr.get("resid") is not None:
-                        result += stags[attr["tagname"]][1].format(projectname + "_" + attr["resid"])
-                    elif attr.get("href") is not None:
-                        result += stags[attr["tagname"]][0].format(attr["href"])
-                    else:
-                        result += stags[attr["tagname"]][2]
+    return "xml", "".join(parts)
+
+
+class Richtext:
+    def __init__(self) -> None:
+        super().__init__()
+
+
+class SalsahError(Exception):
+    """Handles errors happening in this file"""
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+
+class LatencyHistogram:
+    """
+    Thread-safe histogram of the request latencies per endpoint
+    """
+
+    # Upper bounds of the buckets in seconds, the last bucket takes everything above
+    bounds: List[float] = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+    def __init__(self) -> None:
+        self.endpoints: Dict[str, Dict] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        with self.lock:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                entry = {"count": 0, "sum": 0.0, "buckets": [0] * (len(self.bounds) + 1)}
+                self.endpoints[endpoint] = entry
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["buckets"][bisect.bisect_left(self.bounds, seconds)] += 1
+
+    def get_percentile(self, endpoint: str, percentile: float) -> float:
+        """
+        Estimates a percentile of the latencies by the upper bound of the bucket it falls into
+
+        :param endpoint: Name of the endpoint
+        :param percentile: Percentile between 0 and 100
+        :return: Latency in seconds, infinity if it is above the last bound
+        """
+        entry = self.endpoints[endpoint]
+        rank = entry["count"] * percentile / 100
+        cumulated = 0
+        for i, bucket_count in enumerate(entry["buckets"]):
+            cumulated += bucket_count
+            if cumulated >= rank:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "bounds": self.bounds,
+                "endpoints": json.loads(json.dumps(self.endpoints))
+            }
+
+    def print_summary(self) -> None:
+        for endpoint, entry in sorted(self.endpoints.items()):
+            logger.info("%s: %d requests, mean %.3fs, p50 <= %ss, p95 <= %ss", endpoint, entry["count"],
+                        entry["sum"] / entry["count"], self.get_percentile(endpoint, 50),
+                        self.get_percentile(endpoint, 95))
+
+
+class Metrics:
+    """
+    Thread-safe counters per stage of the export: time, calls, bytes transferred and errors. The times of calls
+    running in parallel threads add up, so a stage can take more time than the export itself.
+    """
+
+    stages: List[str] = ["ontology", "id paging", "resource fetch", "conversion", "xml write", "csv write",
+                         "output write", "image download"]
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, Dict] = {
+            stage: {"seconds": 0.0, "calls": 0, "bytes": 0, "errors": 0} for stage in self.stages
+        }
+        self.start: float = perf_counter()
+        self.lock: threading.Lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+        """
+        Records one call of a stage
+
+        :param stage: Name of the stage, see stages
+        :param seconds: Time of the call
+        :param nbytes: Bytes transferred or written by the call
+        :param error: The call failed
+        """
+        with self.lock:
+            counter = self.counters[stage]
+            counter["seconds"] += seconds
+            counter["calls"] += 1
+            counter["bytes"] += nbytes
+            if error:
+                counter["errors"] += 1
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "elapsed": perf_counter() - self.start,
+                "stages": json.loads(json.dumps(self.counters))
+            }
+
+    def to_prometheus(self, latency: LatencyHistogram = None) -> str:
+        """
+        :param latency: Latencies of the requests, exported as histogram
+        :return: Counters in the Prometheus text format
+        """
+        metrics = self.to_dict()
+        lines: List[str] = [
+            "# HELP salsah_export_elapsed_seconds Time since the export started",
+            "# TYPE salsah_export_elapsed_seconds gauge",
+            f"salsah_export_elapsed_seconds {metrics['elapsed']}"
+        ]
+        for key, help_text in [("seconds", "Time spent in the stage"), ("calls", "Calls of the stage"),
+                               ("bytes", "Bytes transferred or written by the stage"),
+                               ("errors", "Failed calls of the stage")]:
+            lines.append(f"# HELP salsah_export_stage_{key}_total {help_text}")
+            lines.append(f"# TYPE salsah_export_stage_{key}_total counter")
+            for stage, counter in metrics["stages"].items():
+                lines.append(f"salsah_export_stage_{key}_total{{stage=\"{stage}\"}} {counter[key]}")
+
+        if latency is not None:
+            histogram = latency.to_dict()
+            lines.append("# HELP salsah_request_duration_seconds Latency of the requests to SALSAH")
+            lines.append("# TYPE salsah_request_duration_seconds histogram")
+            for endpoint, entry in sorted(histogram["endpoints"].items()):
+                cumulated = 0
+                for bound, bucket_count in zip(histogram["bounds"] + ["+Inf"], entry["buckets"]):
+                    cumulated += bucket_count
+                    lines.append(f"salsah_request_duration_seconds_bucket{{endpoint=\"{endpoint}\",le=\"{bound}\"}} "
+                                 f"{cumulated}")
+                lines.append(f"salsah_request_duration_seconds_sum{{endpoint=\"{endpoint}\"}} {entry['sum']}")
+                lines.append(f"salsah_request_duration_seconds_count{{endpoint=\"{endpoint}\"}} {entry['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for the responses of the SALSAH API on the local disk. Every response is stored in a
+    file named after the SHA-256 hash of its URL and parameters, sharded into subfolders by the first two digits.
+    """
+
+    def __init__(self, path: str, ttl: int = None, max_size: int = None, offline: bool = False) -> None:
+        """
+        :param path: Folder of the cache
+        :param ttl: Seconds a response stays valid, None to keep responses forever
+        :param max_size: Maximum size of the cache in bytes, None for no limit
+        :param offline: Only responses from the cache are used, regardless of their age
+        """
+        self.path: str = path
+        self.ttl: int = ttl
+        self.max_size: int = max_size
+        self.offline: bool = offline
+        self.hits: int = 0
+        self.misses: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+    def get_filename(self, url: str, params: Dict = None) -> str:
+        key = json.dumps([url, sorted((params or {}).items())])
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def is_expired(self, filename: str) -> bool:
+        if self.ttl is None or self.offline:
+            return False
+        return datetime.now().timestamp() - os.path.getmtime(filename) > self.ttl
+
+    def get(self, url: str, params: Dict = None):
+        """
+        Gets a response from the cache
+
+        :param url: URL of the request
+        :param params: Parameters of the request
+        :return: Content of the response, None if it is not cached or expired
+        """
+        filename = self.get_filename(url, params)
+        content = None
+        try:
+            if self.is_expired(filename):
+                os.remove(filename)
+            else:
+                with open(filename, "rb") as f:
+                    content = f.read()
+        except OSError:
+            pass
+
+        with self.lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return content
+
+    def put(self, url: str, params: Dict, content: bytes) -> None:
+        """
+        Stores a response in the cache
+
+        :param url: URL of the request
+        :param params: Parameters of the request
+        :param content: Content of the response
+        """
+        filename = self.get_filename(url, params)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Writes to a temporary file first, so concurrent readers never see a partial response
+        tmp_filename = f"{filename}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(content)
+        os.replace(tmp_filename, filename)
+
+    def prune(self) -> None:
+        """
+        Removes the expired responses and, if the cache is larger than max_size, the oldest ones
+        """
+        entries: List = []
+        for folder, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                filename = os.path.join(folder, filename)
+                if self.is_expired(filename):
+                    os.remove(filename)
                 else:
-                    result += stags[attr["tagname"]]
-                stack.append(attr)
-            elif attr["type"] == "end":
-                match = False
-                tmpstack: List = []
-                while True:
-                    tmp = stack.pop()
-                    result += etags[tmp["tagname"]]
-                    if tmp["tagname"] == attr["tagname"] and tmp["type"] == "start":
-                        match = True
-                        break
-                    else:
-                        tmpstack.append(tmp)
-                while len(tmpstack) > 0:
-                    tmp = tmpstack.pop()
-                    check_list = stags[tmp["tagname"]]
-                    if isinstance(check_list, list):
-                        if tmp.get("resid") is not None:
-                            result += check_list[1].format(projectname + "_" + tmp["resid"])
-                        elif tmp.get("href") is not None:
-                            result += check_list[0].format(tmp["href"])
-                        else:
-                            result += check_list[2]
-                    else:
-                        result += check_list
+                    stat = os.stat(filename)
+                    entries.append((stat.st_mtime, stat.st_size, filename))
+
+        if self.max_size is None:
+            return
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, filename in sorted(entries):
+            if size <= self.max_size:
+                break
+            os.remove(filename)
+            size -= entry_size
+
+
+class ImageDownloader:
+    """
+    Downloads the image files in a thread pool of its own, so the export of the metadata does not wait for them.
+    Partial files are resumed with HTTP range requests, complete files are skipped, and every downloaded file is
+    listed with its size, modification time and SHA-256 hash in a manifest. Existing files are skipped if size and
+    modification time match their manifest entry. Otherwise (or always with verify) their hash is checked, files
+    without an entry are checked against the size announced by the server. Files which don't match are downloaded
+    again.
+    """
+
+    chunk_size: int = 1024 * 1024
+
+    def __init__(self, request: Callable, workers: int, manifest_filename: str, metrics: Metrics = None,
+                 verify: bool = False) -> None:
+        """
+        :param request: Function sending a request, see Salsah.request
+        :param workers: Number of files downloaded concurrently
+        :param manifest_filename: Name of the manifest file (JSON lines), entries of an earlier run are kept
+        :param metrics: Metrics the downloads are counted in
+        :param verify: Checks the hash of every existing file, even if size and modification time match
+        """
+        self.request: Callable = request
+        self.metrics: Metrics = metrics if metrics is not None else Metrics()
+        self.verify: bool = verify
+        self.manifest_filename: str = manifest_filename
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers)
+        self.lock: threading.Lock = threading.Lock()
+        self.counts: Dict[str, int] = {"downloaded": 0, "resumed": 0, "skipped": 0, "failed": 0}
+
+        # Loads the files downloaded by an earlier run
+        self.manifest: Dict[str, Dict] = {}
+        if os.path.exists(manifest_filename):
+            with open(manifest_filename, encoding="utf8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.manifest[entry["path"]] = entry
+
+        self.manifest_file = open(manifest_filename, "a", encoding="utf8")
+
+    def submit(self, url: str, path: str) -> None:
+        """
+        Queues the download of an image file
+
+        :param url: URL of the image file
+        :param path: Path of the image file on the local disk
+        """
+        self.executor.submit(self.download, url, path)
+
+    def download(self, url: str, path: str) -> None:
+        start = perf_counter()
+        nbytes = 0
+        try:
+            entry = self.manifest.get(path)
+            if os.path.exists(path):
+                if self.is_complete(url, path, entry):
+                    self.count("skipped")
+                    return
+                # Earlier versions wrote straight to the path, so an interrupted run could leave a truncated file
+                logger.warning("Downloading %s again, the existing file is incomplete", os.path.basename(path))
+                os.remove(path)
+
+            logger.debug("Downloading %s...", os.path.basename(path))
+            part_path = f"{path}.part"
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+            response = self.request(url, stream=True, headers=headers)
+            response.raise_for_status()
+
+            # Starts over if the server ignores the range request
+            if response.status_code != 206:
+                offset = 0
+
+            sha256 = self.get_hash(part_path) if offset > 0 else hashlib.sha256()
+            with open(part_path, "ab" if offset > 0 else "wb") as fd:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    fd.write(chunk)
+                    sha256.update(chunk)
+                    nbytes += len(chunk)
+
+            os.replace(part_path, path)
+            self.add_to_manifest(url, path, sha256)
+            self.count("resumed" if offset > 0 else "downloaded")
+            self.metrics.record("image download", perf_counter() - start, nbytes)
+
+        except Exception as e:
+            logger.error("Download of %s failed. Message %s", url, e)
+            self.count("failed")
+            self.metrics.record("image download", perf_counter() - start, nbytes, error=True)
+
+    def is_complete(self, url: str, path: str, entry: Dict = None) -> bool:
+        """
+        Checks an existing image file against its manifest entry, or against the size announced by the server if
+        the file is not in the manifest. Files which are complete but not listed with their current modification
+        time are added to the manifest.
+
+        :param url: URL of the image file
+        :param path: Path of the image file on the local disk
+        :param entry: Manifest entry of the file, None if there is none
+        :return: True if the file doesn't have to be downloaded again
+        """
+        stat = os.stat(path)
+        if entry is not None:
+            if entry["size"] != stat.st_size:
+                return False
+            if not self.verify and entry.get("mtime") == stat.st_mtime_ns:
+                return True
+            sha256 = self.get_hash(path)
+            if entry["sha256"] != sha256.hexdigest():
+                return False
+        else:
+            response = self.request(url, method="HEAD")
+            response.raise_for_status()
+            content_length = response.headers.get("Content-Length")
+            if content_length is None or int(content_length) != stat.st_size:
+                return False
+            sha256 = self.get_hash(path)
+
+        if entry is None or entry.get("mtime") != stat.st_mtime_ns:
+            self.add_to_manifest(url, path, sha256)
+        return True
+
+    def get_hash(self, path: str):
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as fd:
+            for chunk in iter(lambda: fd.read(self.chunk_size), b""):
+                sha256.update(chunk)
+        return sha256
+
+    def add_to_manifest(self, url: str, path: str, sha256) -> Dict:
+        stat = os.stat(path)
+        entry = {
+            "path": path,
+            "url": url,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "sha256": sha256.hexdigest()
+        }
+        with self.lock:
+            self.manifest[path] = entry
+            self.manifest_file.write(json.dumps(entry) + "\n")
+            self.manifest_file.flush()
+        return entry
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] += 1
+
+    def cancel(self) -> None:
+        """
+        Drops the queued files after a failed export, the manifest keeps the finished ones for --resume
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.manifest_file.close()
+
+    def close(self) -> None:
+        """
+        Waits until all queued files are downloaded
+        """
+        self.executor.shutdown(wait=True)
+        self.manifest_file.close()
+        logger.info("Images: %d downloaded, %d resumed, %d skipped, %d failed", self.counts["downloaded"],
+                    self.counts["resumed"], self.counts["skipped"], self.counts["failed"])
+
+
+class XmlWriter:
+    """
+    Writes the data XML resource by resource, so the document never has to be held in memory as a whole. The
+    file is written as "{filename}.part" and only gets its name when it is complete.
+    """
+
+    def __init__(self, filename: str, root_element, compression: str = None) -> None:
+        """
+        :param filename: Name of the XML file
+        :param root_element: Root element with the permissions, see Salsah.get_root_element
+        :param compression: Compresses the file with gzip, xz or zstd, the ending is appended to the name
+        """
+        self.filename: str = compressed_filename(filename, compression)
+
+        # Serializes the root element around a placeholder to get the parts before and after the resources
+        placeholder = etree.Comment("resources")
+        root_element.append(placeholder)
+        document = etree.tostring(root_element, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        root_element.remove(placeholder)
+        head, self.tail = document.split(b"  <!--resources-->\n")
+
+        self.file = open_output(f"{self.filename}.part", "wb", compression)
+        self.file.write(head)
+
+    @staticmethod
+    def serialize(res_element) -> bytes:
+        """
+        Serializes a resource element the way it appears in the data XML
+
+        :param res_element: Resource element as returned by Salsah.process_resource
+        :return: XML fragment
+        """
+        # Indents the resource as if it were pretty printed as a child of the root element
+        XmlWriter.indent(res_element, level=1)
+        return etree.tostring(res_element, encoding="utf-8", with_tail=False)
+
+    @staticmethod
+    def indent(element, level: int, depth: int = 2) -> None:
+        """
+        Indents an element like etree.indent, but only down to the values of the properties. The markup of rich
+        text values is mixed content, where added whitespace would change the text.
+
+        :param element: Element to indent
+        :param level: Nesting level of the element in the document
+        :param depth: Number of levels below the element which are indented
+        """
+        if len(element) == 0 or depth == 0:
+            return
+
+        if not element.text or not element.text.strip():
+            element.text = "\n" + "  " * (level + 1)
+        for child in element:
+            XmlWriter.indent(child, level + 1, depth - 1)
+            if not child.tail or not child.tail.strip():
+                child.tail = "\n" + "  " * (level + 1)
+        child.tail = "\n" + "  " * level
+
+    def write(self, res_element) -> bytes:
+        """
+        Writes one resource element to the file. The element can be dropped afterwards.
+
+        :param res_element: Resource element as returned by Salsah.process_resource
+        :return: XML fragment that was written
+        """
+        fragment = self.serialize(res_element)
+        self.write_fragment(fragment)
+        return fragment
+
+    def write_fragment(self, fragment: bytes) -> None:
+        """
+        Writes an already serialized resource to the file
+
+        :param fragment: XML fragment as returned by serialize
+        """
+        self.file.write(b"  " + fragment + b"\n")
+
+    def close(self) -> None:
+        self.file.write(self.tail)
+        self.file.close()
+        os.replace(f"{self.filename}.part", self.filename)
+
+
+class ShardedXmlWriter:
+    """
+    Writes the data XML in parts "{filename}.000.xml", "{filename}.001.xml", ... of at most 'shard_size' resources
+    or bytes. Every part is a standalone document with the root element. Resources pointing to resources which
+    were not written yet are held back, so their targets end up in the same or an earlier part where possible.
+    """
+
+    # Resource pointers and links in rich text
+    reference_pattern = re.compile(rb'<resptr[^>]*>([^<]+)</resptr>|IRI:([^:<"]+):IRI')
+    id_pattern = re.compile(rb'<resource id="([^"]*)"')
+
+    def __init__(self, filename: str, root_element, shard_size: int, by_bytes: bool = False,
+                 max_held: int = 10000, compression: str = None) -> None:
+        """
+        :param filename: Name of the XML files without the part number and ending
+        :param root_element: Root element with the permissions, see Salsah.get_root_element
+        :param shard_size: Maximum number of resources (or bytes) per part
+        :param by_bytes: Limits the size of the parts in bytes instead of resources
+        :param max_held: Maximum number of resources held back, the oldest is written anyway when it is exceeded
+        :param compression: Compresses the parts with gzip, xz or zstd, the size limit applies before compression
+        """
+        self.filename: str = filename
+        self.root_element = root_element
+        self.shard_size: int = shard_size
+        self.by_bytes: bool = by_bytes
+        self.max_held: int = max_held
+        self.compression: str = compression
+
+        self.shard: XmlWriter = None
+        self.nshards: int = 0
+        self.shard_resources: int = 0
+        self.shard_bytes: int = 0
+        # Ids of the resources written so far
+        self.written: set = set()
+        # Resources waiting for their targets: (id, ids of the targets, fragment)
+        self.held: deque = deque()
+        # Resources to be written next
+        self.ready: deque = deque()
+
+    def write_fragment(self, fragment: bytes) -> None:
+        """
+        Writes a serialized resource, or holds it back if it points to resources which were not written yet
+
+        :param fragment: XML fragment as returned by XmlWriter.serialize
+        """
+        res_id = self.id_pattern.search(fragment).group(1)
+        targets = set(m.group(1) or m.group(2) for m in self.reference_pattern.finditer(fragment))
+        targets.discard(res_id)
+
+        if targets <= self.written:
+            self.emit(res_id, fragment)
+        else:
+            self.held.append((res_id, targets, fragment))
+            if len(self.held) > self.max_held:
+                res_id, _, fragment = self.held.popleft()
+                self.emit(res_id, fragment)
+
+    def emit(self, res_id: bytes, fragment: bytes) -> None:
+        self.ready.append((res_id, fragment))
+        while len(self.ready) > 0:
+            res_id, fragment = self.ready.popleft()
+            size = len(fragment) + 3
+
+            if self.shard is not None and self.shard_resources > 0:
+                if self.by_bytes:
+                    full = self.shard_bytes + size > self.shard_size
+                else:
+                    full = self.shard_resources >= self.shard_size
+                if full:
+                    self.next_shard()
+
+            if self.shard is None:
+                self.open_shard()
+
+            self.shard.write_fragment(fragment)
+            self.shard_resources += 1
+            self.shard_bytes += size
+            self.written.add(res_id)
+
+    def open_shard(self) -> None:
+        self.shard = XmlWriter(f"{self.filename}.{self.nshards:03d}.xml", self.root_element, self.compression)
+        self.nshards += 1
+        self.shard_resources = 0
+        self.shard_bytes = 0
+
+    def next_shard(self) -> None:
+        """
+        Closes the current part. The held back resources whose targets are written by now go into the next part.
+        """
+        self.shard.close()
+        self.shard = None
+
+        held: deque = deque()
+        for res_id, targets, fragment in self.held:
+            if targets <= self.written:
+                self.ready.append((res_id, fragment))
+            else:
+                held.append((res_id, targets, fragment))
+        self.held = held
+
+    def close(self) -> None:
+        # The resources still held back point to resources which are missing or were written after them
+        while len(self.held) > 0:
+            res_id, _, fragment = self.held.popleft()
+            self.emit(res_id, fragment)
+
+        # Writes at least one (empty) part
+        if self.shard is None and self.nshards == 0:
+            self.open_shard()
+        if self.shard is not None:
+            self.shard.close()
+            self.shard = None
+
+        logger.info("Data XML written in %d parts", self.nshards)
+
+
+class CsvWriter:
+    """
+    Writes the rows of the data CSV while the resources are processed. The columns depend on the maximum number
+    of values per property. If that number is declared upfront, the rows go straight into the CSV file. Otherwise
+    they are spilled to a temporary file and copied into the CSV file with the final header on close. The CSV file
+    is written as "{filename}.part" and only gets its name when it is complete.
+    """
+
+    def __init__(self, filename: str, max_values: int = None, compression: str = None) -> None:
+        """
+        :param filename: Name of the CSV file
+        :param max_values: Declared maximum number of values per property, None if unknown
+        :param compression: Compresses the file (and the spill file) with gzip, xz or zstd, the ending is appended
+                            to the name
+        """
+        self.filename: str = compressed_filename(filename, compression)
+        self.spill_filename: str = compressed_filename(f"{filename}.spill", compression)
+        self.compression: str = compression
+        self.file = None
+        self.writer = None
+        self.spill = None
+
+        if max_values is not None:
+            self.file = open_output(f"{self.filename}.part", "w", compression, encoding="utf8", newline="")
+            self.writer = csv.DictWriter(self.file, delimiter=";", fieldnames=self.get_row_headers(max_values))
+            self.writer.writeheader()
+        else:
+            self.spill = open_output(self.spill_filename, "w", compression, encoding="utf8")
+
+    @staticmethod
+    def get_row_headers(max_values: int) -> List[str]:
+        row_headers = ["id", "restype", "label", "ark", "permissions", "file", "prop name", "prop type", "prop list"]
+
+        for counter in range(max_values):
+            row_headers.append(f"{counter + 1}_value")
+            row_headers.append(f"{counter + 1}_encoding")
+            row_headers.append(f"{counter + 1}_res ref")
+            row_headers.append(f"{counter + 1}_permissions")
+            row_headers.append(f"{counter + 1}_comment")
+
+        return row_headers
+
+    def write(self, rows: List[Dict]) -> None:
+        """
+        Writes the rows of one resource (resource row followed by its property rows)
+
+        :param rows: Rows as returned by Salsah.process_resource
+        """
+        if self.writer is not None:
+            try:
+                self.writer.writerows(rows)
+            except ValueError:
+                raise SalsahError(f"SALSAH-ERROR:\nResource {rows[0]['id']} has more values than declared with --max-values")
+        else:
+            for row in rows:
+                self.spill.write(json.dumps(row) + "\n")
+
+    def close(self, max_values: int) -> None:
+        """
+        Finishes the CSV file
+
+        :param max_values: Maximum number of values per property found in the data
+        """
+        if self.writer is not None:
+            self.file.close()
+            os.replace(f"{self.filename}.part", self.filename)
+            return
+
+        self.spill.close()
+        with open_output(f"{self.filename}.part", "w", self.compression, encoding="utf8", newline="") as f, \
+                open_input(self.spill_filename, encoding="utf8") as spill:
+            writer = csv.DictWriter(f, delimiter=";", fieldnames=self.get_row_headers(max_values))
+            writer.writeheader()
+            for line in spill:
+                writer.writerow(json.loads(line))
+        os.replace(f"{self.filename}.part", self.filename)
+        os.remove(self.spill_filename)
+
+
+class OutputBackend(ABC):
+    """
+    Additional output of the export, written while the resources are processed. Every backend gets the CSV rows of
+    each resource (see Salsah.convert_resource), so several backends are fed from the same pass over the data.
+    Backends write to part_filename, close gives the complete file its name.
+    """
+
+    # Ending of the output file
+    ending: str = ""
+
+    # Columns of a value in the CSV rows, "{counter}_{column}"
+    value_pattern = re.compile(r"^(\d+)_(.+)$")
+
+    def __init__(self, filename: str, compression: str = None) -> None:
+        """
+        :param filename: Name of the output file without the ending
+        :param compression: Compression of the export, backends with their own compression map it to that
+        """
+        self.filename: str = filename + self.ending
+        self.compression: str = compression
+
+    @property
+    def part_filename(self) -> str:
+        return f"{self.filename}.part"
+
+    @staticmethod
+    def get_values(row: Dict) -> List[Dict]:
+        """
+        :param row: Property row of the CSV rows
+        :return: Values of the property with their columns ("value", "encoding", "res ref", "permissions",
+                 "comment"), in the order of the property
+        """
+        values: Dict[int, Dict] = {}
+        for key, column in row.items():
+            match = OutputBackend.value_pattern.match(key)
+            if match is not None:
+                values.setdefault(int(match.group(1)), {})[match.group(2)] = column
+        return [values[counter] for counter in sorted(values)]
+
+    @abstractmethod
+    def write(self, rows: List[Dict]) -> None:
+        """
+        Writes one resource
+
+        :param rows: Resource row followed by its property rows, as returned by Salsah.process_resource
+        """
+
+    def close(self) -> None:
+        os.replace(self.part_filename, self.filename)
+
+
+class JsonLinesBackend(OutputBackend):
+    """
+    Writes one JSON object per line and resource, with the properties and their values nested in it
+    """
+
+    ending = ".jsonl"
+
+    def __init__(self, filename: str, compression: str = None) -> None:
+        super().__init__(filename, compression)
+        self.filename = compressed_filename(self.filename, compression)
+        self.file = open_output(self.part_filename, "w", compression, encoding="utf-8")
+
+    def write(self, rows: List[Dict]) -> None:
+        resource: Dict = dict(rows[0])
+        resource["properties"] = [{
+            "name": row["prop name"],
+            "type": row["prop type"],
+            "list": row.get("prop list"),
+            "values": self.get_values(row)
+        } for row in rows[1:]]
+        self.file.write(json.dumps(resource, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+
+class SqliteBackend(OutputBackend):
+    """
+    Writes the resources into an SQLite database: a table "resources" and a table "property_values" with one row
+    per value, indexed by resource id and property. The rows are committed in batches.
+    """
+
+    ending = ".sqlite"
+
+    def __init__(self, filename: str, compression: str = None, batch_size: int = 1000) -> None:
+        """
+        :param batch_size: Number of resources per transaction
+        """
+        super().__init__(filename, compression)
+        self.batch_size: int = batch_size
+        self.pending: int = 0
+
+        # A resumed export writes all the resources again
+        if os.path.exists(self.part_filename):
+            os.remove(self.part_filename)
+        self.connection = sqlite3.connect(self.part_filename)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("CREATE TABLE resources (id TEXT PRIMARY KEY, restype TEXT, label TEXT, ark TEXT, "
+                                "permissions TEXT, file TEXT)")
+        self.connection.execute("CREATE TABLE property_values (resource_id TEXT, property TEXT, type TEXT, "
+                                "list TEXT, position INTEGER, value TEXT, encoding TEXT, res_ref TEXT, "
+                                "permissions TEXT, comment TEXT)")
+
+    def write(self, rows: List[Dict]) -> None:
+        resource = rows[0]
+        self.connection.execute("INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?)", (
+            resource["id"], resource["restype"], resource["label"], resource.get("ark"), resource["permissions"],
+            resource.get("file")))
+        self.connection.executemany("INSERT INTO property_values VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            (resource["id"], row["prop name"], row["prop type"], row.get("prop list"), position, value.get("value"),
+             value.get("encoding"), value.get("res ref"), value.get("permissions"), value.get("comment"))
+            for row in rows[1:] for position, value in enumerate(self.get_values(row), 1)])
+
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self) -> None:
+        # The index is built once at the end, which is faster than updating it with every insert
+        self.connection.execute("CREATE INDEX property_values_resource ON property_values (resource_id, property)")
+        self.connection.commit()
+        self.connection.close()
+        super().close()
+
+
+class ParquetBackend(OutputBackend):
+    """
+    Writes the values into a Parquet file, one row per value with the columns of its resource and property. The
+    rows are written in row groups of batch_size rows. Needs the package pyarrow.
+    """
+
+    ending = ".parquet"
+
+    # Parquet codecs of the compressions of the export
+    codecs: Dict[str, str] = {"gzip": "gzip", "zstd": "zstd"}
+
+    columns: List[str] = ["resource_id", "restype", "label", "ark", "file", "property", "type", "list", "position",
+                          "value", "encoding", "res_ref", "permissions", "comment"]
+
+    def __init__(self, filename: str, compression: str = None, batch_size: int = 100000) -> None:
+        """
+        :param batch_size: Number of rows per row group
+        """
+        super().__init__(filename, compression)
+        self.batch_size: int = batch_size
+        self.schema = pyarrow.schema([(column, pyarrow.int32() if column == "position" else pyarrow.string())
+                                      for column in self.columns])
+        self.batch: Dict[str, List] = {column: [] for column in self.columns}
+        self.nrows: int = 0
+        self.writer = pyarrow.parquet.ParquetWriter(self.part_filename, self.schema,
+                                                    compression=self.codecs.get(compression, "snappy"))
+
+    def write(self, rows: List[Dict]) -> None:
+        resource = rows[0]
+        for row in rows[1:]:
+            for position, value in enumerate(self.get_values(row), 1):
+                for column, column_value in zip(self.columns, (
+                        resource["id"], resource["restype"], resource["label"], resource.get("ark"),
+                        resource.get("file"), row["prop name"], row["prop type"], row.get("prop list"), position,
+                        value.get("value"), value.get("encoding"), value.get("res ref"), value.get("permissions"),
+                        value.get("comment"))):
+                    self.batch[column].append(column_value)
+                self.nrows += 1
+
+        if self.nrows >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.nrows > 0:
+            self.writer.write_table(pyarrow.Table.from_pydict(self.batch, schema=self.schema))
+            self.batch = {column: [] for column in self.columns}
+            self.nrows = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+        super().close()
+
+
+# Additional outputs of the export, see --output
+output_backends: Dict[str, type] = {
+    "jsonl": JsonLinesBackend,
+    "sqlite": SqliteBackend,
+    "parquet": ParquetBackend
+}
+
+
+class IdStore:
+    """
+    Compact set of the resource ids added by exports, in the format "{project}_{id}". The ids of every project are
+    kept as sorted array of 64 bit integers, which is looked up with a binary search. On disk, the arrays follow a
+    JSON header line and are memory-mapped when the file is loaded, so even millions of ids are available right
+    away and take little memory. Ids which are not numbers are kept in the header.
+    """
+
+    magic: bytes = b"SALSAHIDS1\n"
+
+    def __init__(self, projects: Dict = None, others: set = None) -> None:
+        """
+        :param projects: Sorted array (or memoryview) of the ids per project
+        :param others: Ids which are not numbers
+        """
+        self.projects: Dict = projects if projects is not None else {}
+        self.others: set = others if others is not None else set()
+        self.mapped = None
+
+    @staticmethod
+    def split(res_id: str):
+        """
+        :param res_id: Id in the format "{project}_{id}"
+        :return: Project and numeric id, None if the id is not a number
+        """
+        project, _, number = res_id.rpartition("_")
+        if project == "" or not number.isdigit():
+            return None
+        return project, int(number)
+
+    @classmethod
+    def from_ids(cls, res_ids: Iterable[str]) -> "IdStore":
+        """
+        :param res_ids: Ids in the format "{project}_{id}", e.g. the keys of an all_ids.json file
+        """
+        projects: Dict[str, array] = {}
+        others: set = set()
+        for res_id in res_ids:
+            parts = cls.split(res_id)
+            if parts is None:
+                others.add(res_id)
+            else:
+                projects.setdefault(parts[0], array("q")).append(parts[1])
+
+        for project, ids in projects.items():
+            projects[project] = array("q", sorted(set(ids)))
+
+        return cls(projects, others)
+
+    @classmethod
+    def load(cls, filename: str) -> "IdStore":
+        """
+        Loads an id store file. The arrays are memory-mapped, they are only read when they are looked up.
+        """
+        with open(filename, "rb") as f:
+            if f.read(len(cls.magic)) != cls.magic:
+                raise SalsahError(f"SALSAH-ERROR:\n{filename} is not an id store file")
+            header: Dict = json.loads(f.readline())
+            start = f.tell() + (-f.tell() % 8)
+            if header["count"] == 0:
+                return cls({}, set(header["others"]))
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data = memoryview(mapped)[start:]
+        projects: Dict = {}
+        for project, (offset, n) in header["projects"].items():
+            ids = data[offset * 8:(offset + n) * 8].cast("q")
+            # Files written on a machine with another byte order are read into memory once
+            if header["byteorder"] != sys.byteorder:
+                ids = array("q", ids.tobytes())
+                ids.byteswap()
+            projects[project] = ids
+
+        store = cls(projects, set(header["others"]))
+        store.mapped = mapped
+        return store
+
+    @staticmethod
+    def is_store_file(filename: str) -> bool:
+        with open(filename, "rb") as f:
+            return f.read(len(IdStore.magic)) == IdStore.magic
+
+    def __contains__(self, res_id: str) -> bool:
+        parts = self.split(res_id)
+        if parts is None:
+            return res_id in self.others
+
+        ids = self.projects.get(parts[0])
+        if ids is None:
+            return False
+        i = bisect.bisect_left(ids, parts[1])
+        return i < len(ids) and ids[i] == parts[1]
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.projects.values()) + len(self.others)
+
+    def __iter__(self) -> Iterator[str]:
+        for project, ids in self.projects.items():
+            for number in ids:
+                yield f"{project}_{number}"
+        yield from self.others
+
+    def merge(self, res_ids: Iterable[str]) -> "IdStore":
+        """
+        :param res_ids: Ids to add, in the format "{project}_{id}"
+        :return: New store with the ids of this store and the given ids
+        """
+        added = IdStore.from_ids(res_ids)
+        projects: Dict[str, array] = {}
+        for project in self.projects.keys() | added.projects.keys():
+            # Both arrays are sorted, so they are merged without holding the ids as Python objects
+            ids = array("q")
+            for number in heapq.merge(self.projects.get(project, ()), added.projects.get(project, ())):
+                if len(ids) == 0 or ids[-1] != number:
+                    ids.append(number)
+            projects[project] = ids
+        return IdStore(projects, self.others | added.others)
+
+    def close(self) -> None:
+        """
+        Releases the memory-mapped file, so it can be replaced (which fails on Windows while it is mapped). The
+        store is empty afterwards.
+        """
+        if self.mapped is None:
+            return
+        for ids in self.projects.values():
+            if isinstance(ids, memoryview):
+                ids.release()
+        self.projects = {}
+        self.mapped.close()
+        self.mapped = None
+
+    def save(self, filename: str) -> None:
+        """
+        Writes the store to a file. The file is replaced only when it was written completely.
+        """
+        index: Dict = {}
+        offset = 0
+        for project, ids in self.projects.items():
+            index[project] = [offset, len(ids)]
+            offset += len(ids)
+        header: bytes = json.dumps({
+            "projects": index,
+            "others": sorted(self.others),
+            "count": offset,
+            "byteorder": sys.byteorder
+        }).encode("utf-8")
+
+        # The arrays start at the next multiple of 8 bytes after the header line
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(self.magic + header + b"\n")
+            f.write(b"\0" * (-f.tell() % 8))
+            for ids in self.projects.values():
+                f.write(array("q", ids).tobytes())
+        os.replace(tmp_filename, filename)
+
+
+class ExportContext:
+    """
+    Resources already added, which are not exported again. The resources added by earlier exports are looked up
+    in a read-only IdStore. The resources added by this export are split into shards with a lock each, so concurrent
+    exports rarely wait for each other. Several Salsah objects can share one context to export several projects
+    from one process without duplicates.
+    """
+
+    def __init__(self, store: IdStore = None, shards: int = 16) -> None:
+        """
+        :param store: Resources added by earlier exports, see get_ids_from_file
+        :param shards: Number of shards of the added resources
+        """
+        self.store: IdStore = store if store is not None else IdStore()
+        self.shards: List[Dict[str, int]] = [{} for _ in range(shards)]
+        self.shard_locks: List[threading.Lock] = [threading.Lock() for _ in range(shards)]
+        # Numbers the added resources, so get_added returns them in the order they were added
+        self.sequence = count()
+
+    def add(self, res_id: str, updated: bool = False) -> bool:
+        """
+        Marks a resource as added
+
+        :param res_id: ID of the resource, prefixed with the project name
+        :param updated: The resource changed since an earlier export, so it is exported again even if it is in
+                        the store
+        :return: False if the resource was already added
+        """
+        if not updated and res_id in self.store:
+            return False
+
+        shard = hash(res_id) % len(self.shards)
+        with self.shard_locks[shard]:
+            if res_id in self.shards[shard]:
+                return False
+            self.shards[shard][res_id] = next(self.sequence)
+            return True
+
+    def get_added(self) -> List[str]:
+        """
+        :return: Resources added by this export in the order they were added
+        """
+        added: List = []
+        for shard, lock in zip(self.shards, self.shard_locks):
+            with lock:
+                added.extend(shard.items())
+        added.sort(key=itemgetter(1))
+        return [res_id for res_id, _ in added]
+
+    def get_store(self) -> IdStore:
+        """
+        :return: Store with the resources added by earlier exports and by this export
+        """
+        return self.store.merge(self.get_added())
+
+
+class ExportJournal:
+    """
+    Append-only journal of the resources exported so far. Every processed resource is recorded together with
+    its XML fragment and CSV rows, so an interrupted export can be resumed without fetching these resources again.
+    The journal is removed when the export is complete.
+    """
+
+    def __init__(self, filename: str) -> None:
+        """
+        :param filename: Name of the journal file
+        """
+        self.filename: str = filename
+        self.file = None
+
+    def load(self) -> Iterator[Dict]:
+        """
+        Reads the entries of an existing journal one by one. A last line that was only partially written is
+        dropped once all the entries are read.
+
+        :return: Iterator of the journal entries in the order they were recorded
+        """
+        if not os.path.exists(self.filename):
+            return
+
+        valid_size = 0
+        with open(self.filename, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning("Dropping incomplete entry at the end of the journal %s", self.filename)
+                    break
+                valid_size += len(line)
+                yield entry
+
+        # Cuts off the incomplete entry, so new entries start on a clean line
+        os.truncate(self.filename, valid_size)
+
+    def open(self, append: bool) -> None:
+        """
+        :param append: Keeps the existing entries, otherwise the journal starts empty
+        """
+        self.file = open(self.filename, "a" if append else "w", encoding="utf8")
+
+    def record(self, res_id: str, fragment: bytes = None, csv_res: List = None, image_location: Tuple = None,
+               max_values: int = 0, fingerprint: str = None) -> None:
+        """
+        Records an exported resource
+
+        :param res_id: ID of the resource in SALSAH
+        :param fragment: XML fragment of the resource, None if the resource was skipped
+        :param csv_res: CSV rows of the resource, None if the resource was skipped
+        :param image_location: URL and path of the image file of the resource, see Salsah.get_image_location
+        :param max_values: Maximum number of values per property found so far
+        :param fingerprint: Fingerprint of the resource, see Salsah.get_fingerprint
+        """
+        entry: Dict = {
+            "res_id": res_id,
+            "xml": fragment.decode("utf-8") if fragment is not None else None,
+            "csv": csv_res,
+            "image": image_location,
+            "max_values": max_values,
+            "fingerprint": fingerprint
+        }
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+    def remove(self) -> None:
+        """
+        Removes the journal of a complete export, it holds a copy of all the output
+        """
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+class ValueConverter:
+    """
+    Converts the values of one value type into an XML element and the columns for the CSV file. This default
+    converter puts the value as it is (optionally prefixed) into an element. Converters are registered per value
+    type with Salsah.register_value_converter.
+    """
+
+    def __init__(self, name: str, tag: str = None, prefix: str = "") -> None:
+        """
+        :param name: Name of the value type used in the log
+        :param tag: Tag of the XML element (default: name)
+        :param prefix: Prefix added to the value
+        """
+        self.name: str = name
+        self.tag: str = tag if tag is not None else name
+        self.prefix: str = prefix
+
+    def convert(self, value: any, counter: int):
+        """
+        Converts a value
+
+        :param value: Value as it is delivered by SALSAH
+        :param counter: Number of the value within its property, used for the CSV columns
+        :return: XML element (None if the value is empty) and dict with the CSV columns
+        """
+        if not value:
+            return None, {}
+
+        val_element = etree.Element(self.tag)
+        val_element.text = f"{self.prefix}{value}"
+        return val_element, {f"{counter}_value": val_element.text}
+
+    def describe(self, value: any) -> str:
+        """
+        :return: Representation of the value in the log
+        """
+        return value
+
+
+class TextConverter(ValueConverter):
+    def convert(self, value: any, counter: int):
+        if not value:
+            return None, {}
+
+        val_element = etree.Element(self.tag)
+        val_element.text = value.replace("\"", "'").replace("<", "").replace(">", "")
+        val_element.set("encoding", "utf8")
+        # TODO: replace characters in value
+        return val_element, {f"{counter}_value": value, f"{counter}_encoding": "utf8"}
+
+
+class RichtextConverter(ValueConverter):
+    def __init__(self, name: str, projectname: str) -> None:
+        super().__init__(name, tag="text")
+        self.projectname: str = projectname
+
+    def convert(self, value: any, counter: int):
+        utf8str = value.get("utf8str").strip()
+        if not utf8str:
+            return None, {}
+
+        encoding, rich_text = process_rich_text(
+            utf8str=utf8str,
+            projectname=self.projectname,
+            textattr=value.get("textattr").strip(),
+            resptrs=value.get("resptrs")
+        )
+
+        val_element = self.get_element(rich_text, encoding)
+        encoding = val_element.get("encoding")
+        csv_values = {f"{counter}_value": rich_text, f"{counter}_encoding": encoding}
+
+        resrefs = "|".join(value["resource_reference"])
+        if len(resrefs) > 0:
+            val_element.set("resrefs", resrefs)
+            csv_values[f"{counter}_res ref"] = resrefs
+
+        return val_element, csv_values
+
+    def get_element(self, rich_text: str, encoding: str):
+        """
+        Creates the element of a rich text value. The markup is parsed into a subtree, so it is serialized as it
+        is and the text itself is escaped like any other text.
+
+        :param rich_text: Text as returned by process_rich_text
+        :param encoding: Encoding as returned by process_rich_text
+        :return: Value element
+        """
+        if encoding == "xml" and "<" in rich_text:
+            try:
+                # The text segments of the markup are free of "<" and ">", see process_rich_text
+                val_element = etree.fromstring(f"<{self.tag}>{rich_text.replace('&', '&amp;')}</{self.tag}>")
+                val_element.set("encoding", encoding)
+                return val_element
+            except etree.XMLSyntaxError as err:
+                logger.warning("Rich text exported as plain text, its markup is not valid (%s)", err)
+                encoding = "utf8"
 
-                    stack.append(tmp)
-            pos = attr["pos"]
-        return "xml", result
-    else:
-        # Not the best solution. All "<" and ">" are eliminated so at the end it is valid
-        return "xml", utf8str.replace("<", "").replace(">", "")
+        val_element = etree.Element(self.tag)
+        val_element.text = rich_text
+        val_element.set("encoding", encoding)
+        return val_element
 
+    def describe(self, value: any) -> str:
+        return value.get("utf8str").strip()
 
-class Richtext:
-    def __init__(self) -> None:
-        super().__init__()
 
+class DateConverter(ValueConverter):
+    def convert(self, value: any, counter: int):
+        if not value:
+            return None, {}
 
-class SalsahError(Exception):
-    """Handles errors happening in this file"""
+        val_element = etree.Element(self.tag)
+        val_element.text = format_date(value["calendar"], value["dateval1"], value["dateval2"],
+                                       value["dateprecision1"], value["dateprecision2"])
+        return val_element, {f"{counter}_value": val_element.text}
 
-    def __init__(self, message: str) -> None:
-        self.message = message
+
+class PeriodConverter(ValueConverter):
+    def convert(self, value: any, counter: int):
+        if not value:
+            return None, {}
+
+        # The period itself is not converted yet, only the CSV file gets the value
+        return etree.Element(self.tag), {f"{counter}_value": value}
 
 
 class Salsah:
@@ -324,7 +1958,16 @@ class Salsah:
             shortcode: str,
             resptrs: dict,
             permissions: dict,
-            session: requests.Session) -> None:
+            session: requests.Session,
+            workers: int = 1,
+            single_request: bool = False,
+            cache: ResponseCache = None,
+            timeouts: Dict = None,
+            download_workers: int = 4,
+            verify_images: bool = False,
+            processes: int = 0,
+            context: ExportContext = None,
+            compression: str = None) -> None:
 
         """
         :param server: Server of old SALSAH (local or http://salsah.org)
@@ -335,6 +1978,15 @@ class Salsah:
         :param shortcode: Shortcode for Knora that is reserved for the project
         :param resptrs: XML file containing object information for resource pointer
         :param session: Session object
+        :param workers: Number of resources fetched concurrently
+        :param single_request: Takes the resource label from the full resource instead of an extra 'info' request
+        :param cache: Cache for the responses of the SALSAH API
+        :param timeouts: Timeouts per endpoint, see endpoint_timeouts
+        :param download_workers: Number of image files downloaded concurrently
+        :param verify_images: Checks the hash of every image file downloaded by an earlier run
+        :param processes: Number of worker processes converting the resources, 0 converts them in this process
+        :param context: Export context, may be shared with other Salsah objects (default: a new context)
+        :param compression: Compresses the XML, CSV and JSON files with gzip, xz or zstd
         """
         super().__init__()
         self.server: str = server
@@ -348,13 +2000,100 @@ class Salsah:
         self.resptrs: Dict = resptrs
         self.permissions: Dict = permissions
         self.session: requests.Session = session
+        self.workers: int = workers
+        self.single_request: bool = single_request
+        self.requests_saved: int = 0
+        self.cache: ResponseCache = cache
+        self.timeouts: Dict = timeouts if timeouts is not None else dict(endpoint_timeouts)
+        self.latency: LatencyHistogram = LatencyHistogram()
+        self.metrics: Metrics = Metrics()
+        self.nhits: int = 0
+        self.download_workers: int = download_workers
+        self.verify_images: bool = verify_images
+        self.downloader: ImageDownloader = None
+        self.processes: int = processes
+        self.compression: str = compression
+        self.context: ExportContext = context if context is not None else ExportContext()
+        self.lock: threading.Lock = threading.Lock()
+        # Maximum number of values per property of this export, which gives the number of CSV columns
+        self.max_values: int = 0
+        self.max_values_lock: threading.Lock = threading.Lock()
 
         self.selection_mapping: Dict[str, str] = {}
         self.selection_node_mapping: Dict[str, str] = {}
         self.hlist_mapping: Dict[str, str] = {}
         self.hlist_node_mapping: Dict[str, str] = {}
+        # Names of the properties in the data XML by SALSAH property name and resource type, see get_property_name
+        self.property_names: Dict[Tuple[str, str], str] = {}
         self.vocabulary: str = ""
 
+        self.value_converters: Dict[int, ValueConverter] = {}
+        self.register_default_value_converters()
+
+    def update_max_values(self, value_counter: int) -> None:
+        """
+        :param value_counter: Number of values of a property
+        """
+        if value_counter > self.max_values:
+            with self.max_values_lock:
+                if value_counter > self.max_values:
+                    self.max_values = value_counter
+
+    def get_json(self, url: str, params: Dict = None, stage: str = "ontology") -> Dict:
+        """
+        Sends a GET request to the SALSAH API. If there is a response cache, the response is taken from there
+        if possible and stored otherwise.
+
+        :param url: URL of the request
+        :param params: Parameters of the request
+        :param stage: Stage of the export the request is counted for, see Metrics
+        :return: JSON result of the request
+        """
+        start = perf_counter()
+        if self.cache is not None:
+            content = self.cache.get(url, params)
+            if content is not None:
+                self.metrics.record(stage, perf_counter() - start)
+                return json.loads(content)
+            if self.cache.offline:
+                self.metrics.record(stage, perf_counter() - start, error=True)
+                raise SalsahError(f"SALSAH-ERROR:\nNo cached response for {url} {params or ''} (offline mode)")
+
+        try:
+            req = self.request(url, params=params, auth=(self.user, self.password))
+            result = req.json()
+        except Exception:
+            self.metrics.record(stage, perf_counter() - start, error=True)
+            raise
+        if result["status"] != 0:
+            self.metrics.record(stage, perf_counter() - start, len(req.content), error=True)
+            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        self.metrics.record(stage, perf_counter() - start, len(req.content))
+
+        if self.cache is not None:
+            self.cache.put(url, params, req.content)
+
+        return result
+
+    def request(self, url: str, method: str = "GET", **kwargs) -> requests.Response:
+        """
+        Sends a request with the timeout of its endpoint and records its latency
+
+        :param url: URL of the request
+        :param method: HTTP method, HEAD is used to check downloaded files
+        :param kwargs: Further arguments for requests.Session.request
+        :return: Response of the request
+        """
+        path = urlparse(url).path.strip("/").split("/")
+        endpoint = path[1] if len(path) > 1 and path[0] == "api" else "download"
+        timeout = self.timeouts.get(endpoint, self.timeouts["default"])
+
+        start = perf_counter()
+        req = self.session.request(method, url, timeout=timeout, **kwargs)
+        self.latency.record(endpoint, perf_counter() - start)
+
+        return req
+
     def get_icon(self, iconsrc: str, name: str) -> str:
         """
         Get an icon from old SALSAH
@@ -364,7 +2103,7 @@ class Salsah:
         :return: Path to the icon on local disk
         """
         iconpath: str = os.path.join(self.assets_path, name)
-        dlfile: str = self.session.get(iconsrc, stream=True)  # war urlretrieve()
+        dlfile: str = self.request(iconsrc, stream=True)  # war urlretrieve()
         with open(iconpath, "w+b") as fd:
             for chunk in dlfile.iter_content(chunk_size=128):
                 fd.write(chunk)
@@ -397,10 +2136,7 @@ class Salsah:
 
         # first get all system ontologies
         voc_url = f"{self.server}/api/vocabularies/0?lang=all"
-        req = self.session.get(voc_url, auth=(self.user, self.password))
-        result = req.json()
-        if result["status"] != 0:
-            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        result = self.get_json(voc_url)
 
         prefixes = dict(map(lambda a: (a["shortname"], a["uri"]), result["vocabularies"]))
 
@@ -412,10 +2148,7 @@ class Salsah:
 
         # get project info
         project_url = f"{self.server}/api/projects/{self.projectname}?lang=all"
-        req = self.session.get(project_url, auth=(self.user, self.password))
-        result = req.json()
-        if result["status"] != 0:
-            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        result = self.get_json(project_url)
 
         shortname = result["project_info"]["shortname"]
         longname = result["project_info"]["longname"]
@@ -446,10 +2179,7 @@ class Salsah:
         # Get the vocabulary. The old Salsah uses only one vocabulary per project....
         # Note: the API call always returns also the system vocabularies which have to be excluded
         project_voc_url = f"{self.server}/api/vocabularies/{self.projectname}"
-        req = self.session.get(project_voc_url, auth=(self.user, self.password))
-        result = req.json()
-        if result["status"] != 0:
-            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        result = self.get_json(project_voc_url)
 
         vocabulary = None
         for voc in result["vocabularies"]:
@@ -568,7 +2298,7 @@ class Salsah:
                             prop["name"] = "isPartOf" + knora_object.replace(vocname + ":", "")
                     else:
                         knora_object = "FIXME--Resource--FIXME"
-                        print(f"{warning()} Resclass {salsah_restype_info[restype_id]['name']} has resptr {property['name']} with no object!")
+                        logger.warning("Resclass %s has resptr %s with no object!", salsah_restype_info[restype_id]["name"], property["name"])
                 elif property["name"] == "region_of":
                     knora_super = ["isRegionOf"]
                     if self.resptrs.get(salsah_restype_info[restype_id]["name"]) is not None:
@@ -577,7 +2307,7 @@ class Salsah:
                             knora_object = tmp["salsah:part_of"]
                     else:
                         knora_object = "FIXME--Resource--FIXME"
-                        print(f"{warning()} Resclass {salsah_restype_info[restype_id]['name']} has resptr {property['name']} with no object!")
+                        logger.warning("Resclass %s has resptr %s with no object!", salsah_restype_info[restype_id]["name"], property["name"])
                 elif property["name"] == "resource_reference":
                     knora_super = ["hasLinkTo"]
                     if self.resptrs.get(salsah_restype_info[restype_id]["name"]) is not None:
@@ -586,7 +2316,7 @@ class Salsah:
                             knora_object = tmp["salsah:part_of"]
                     else:
                         knora_object = "FIXME--Resource--FIXME"
-                        print(f"{warning()} Resclass {salsah_restype_info[restype_id]['name']} has resptr {property['name']} with no object!")
+                        logger.warning("Resclass %s has resptr %s with no object!", salsah_restype_info[restype_id]["name"], property["name"])
                 elif property["name"] == "interval":
                     knora_super = ["hasValue"]
                     knora_object = "IntervalValue"
@@ -604,7 +2334,7 @@ class Salsah:
                             knora_object = tmp["salsah:part_of"]
                     else:
                         knora_object = "FIXME--Resource--FIXME"
-                        print(f"{warning()} Resclass {salsah_restype_info[restype_id]['name']} has sequence_of {property['name']} with no object!")
+                        logger.warning("Resclass %s has sequence_of %s with no object!", salsah_restype_info[restype_id]["name"], property["name"])
                 elif property["name"] == "uri":
                     knora_super = ["hasValue"]
                     knora_object = "UriValue"
@@ -650,7 +2380,7 @@ class Salsah:
                         knora_object = voc + ":" + upper_camel_case(restype)
                     if knora_object is None:
                         knora_object = "FIXME--Resource--FIXME"
-                        print(f"{warning()} Resclass {salsah_restype_info[restype_id]['name']} has resptr {property['name']} with no object!")
+                        logger.warning("Resclass %s has resptr %s with no object!", salsah_restype_info[restype_id]["name"], property["name"])
                 elif property["vt_php_constant"] == "VALTYPE_SELECTION":
                     knora_super = ["hasValue"]
                     knora_object = "ListValue"
@@ -785,24 +2515,21 @@ class Salsah:
             "lang": "all"
         }
         res_types_url = f"{self.server}/api/resourcetypes"
-        req = self.session.get(res_types_url, params=payload, auth=(self.user, self.password))
-        result = req.json()
-        if result["status"] != 0:
-            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        result = self.get_json(res_types_url, payload)
 
         restype_ids: List = list(map(lambda r: r["id"], result["resourcetypes"]))
 
-        salsah_restype_info: Dict = {}
-        for restype_id in restype_ids:
+        def get_restype_info(restype_id: str) -> Dict:
             payload: dict = {
                 "lang": "all"
             }
             res_type_url = f"{self.server}/api/resourcetypes/{restype_id}"
-            req = self.session.get(res_type_url, params=payload, auth=(self.user, self.password))
-            result = req.json()
-            if result["status"] != 0:
-                raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
-            salsah_restype_info[restype_id] = result["restype_info"]
+            result = self.get_json(res_type_url, payload)
+            return result["restype_info"]
+
+        # Fetches the resource types concurrently, the results arrive in the order of restype_ids
+        salsah_restype_info: Dict = dict(zip(restype_ids, ordered_map(get_restype_info, restype_ids, self.workers)))
+        self.map_property_names(salsah_restype_info.values())
 
         restypes_container: List= []
         added_properties: Dict = {}
@@ -864,17 +2591,22 @@ class Salsah:
         }
 
         selections_url = f"{self.server}/api/selections"
-        req = self.session.get(selections_url, params=payload, auth=(self.user, self.password))
-        result = req.json()
-        if result["status"] != 0:
-            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        result = self.get_json(selections_url, payload)
 
         selections = result["selections"]
 
         # Empty list for the lists:
         selections_container = []
 
-        for selection in selections:
+        def get_selection_nodes(selection: Dict) -> Dict:
+            payload = {"lang": "all"}
+            selection_url = f"{self.server}/api/selections/{selection['id']}"
+            return self.get_json(selection_url, payload)
+
+        # Fetches the nodes of the selections concurrently, the results arrive in the order of the selections
+        selections_nodes = ordered_map(get_selection_nodes, selections, self.workers)
+
+        for selection, result_nodes in zip(selections, selections_nodes):
             self.selection_mapping[selection["id"]] = selection["name"]
             root = {
                 "name": selection["name"],
@@ -882,12 +2614,6 @@ class Salsah:
             }
             if selection.get("description") is not None:
                 root["comments"] = dict(map(lambda a: (a["shortname"], a["description"]), selection["description"]))
-            payload = {"lang": "all"}
-            selection_url = f"{self.server}/api/selections/{selection['id']}"
-            req_nodes = self.session.get(selection_url, params=payload, auth=(self.user, self.password))
-            result_nodes = req_nodes.json()
-            if result_nodes["status"] != 0:
-                raise SalsahError("SALSAH-ERROR:\n" + result_nodes["errormsg"])
             self.selection_node_mapping.update(dict(map(lambda a: (a["id"], a["name"]), result_nodes["selection"])))
             root["nodes"] = list(map(lambda a: {
                 "name": "S_" + a["id"],
@@ -902,10 +2628,7 @@ class Salsah:
             "lang": "all"
         }
         hlists_url = f"{self.server}/api/hlists"
-        req = self.session.get(hlists_url, params=payload, auth=(self.user, self.password))
-        result = req.json()
-        if result["status"] != 0:
-            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        result = self.get_json(hlists_url, payload)
         self.hlist_node_mapping.update(dict(map(lambda a: (a["id"], a["name"]), result["hlists"])))
 
         hlists = result["hlists"]
@@ -926,7 +2649,15 @@ class Salsah:
                 newnodes.append(newnode)
             return newnodes
 
-        for hlist in hlists:
+        def get_hlist_nodes(hlist: Dict) -> Dict:
+            payload = {"lang": "all"}
+            hlist_url = f"{self.server}/api/hlists/{hlist['id']}"
+            return self.get_json(hlist_url, payload)
+
+        # Fetches the nodes of the hlists concurrently, the results arrive in the order of the hlists
+        hlists_nodes = ordered_map(get_hlist_nodes, hlists, self.workers)
+
+        for hlist, result_nodes in zip(hlists, hlists_nodes):
             root = {
                 "name": hlist["name"],
                 "labels": dict(map(lambda a: (a["shortname"], a["label"]), hlist["label"]))
@@ -934,12 +2665,6 @@ class Salsah:
             self.hlist_mapping[hlist["id"]] = hlist["name"]
             if hlist.get("description") is not None:
                 root["comments"] = dict(map(lambda a: (a["shortname"], a["description"]), hlist["description"]))
-            payload = {"lang": "all"}
-            hlist_url = f"{self.server}/api/hlists/{hlist['id']}"
-            req_nodes = self.session.get(hlist_url, params=payload, auth=(self.user, self.password))
-            result_nodes = req_nodes.json()
-            if result_nodes["status"] != 0:
-                raise SalsahError("SALSAH-ERROR:\n" + result_nodes["errormsg"])
             root["nodes"] = process_children(result_nodes["hlist"])
             selections_container.append(root)
 
@@ -951,328 +2676,251 @@ class Salsah:
 
         :param project: Project name
         :param start_at: Start at given resource
-        :param show_n_rows: Show n resources
-        :return:
+        :param show_n_rows: Show n resources, 0 or less to get all
+        :return: Number of hits and list of the resource ids
+        """
+        obj_ids = list(self.iter_obj_ids(project, show_n_rows, start_at))
+
+        return self.nhits, obj_ids
+
+    def iter_obj_ids(self, project: str, show_n_rows: int = 0, start_at: int = 0) -> Iterator:
+        """
+        Walks through the search results of the project page by page and yields the resource ids as they arrive.
+        After the first page, the number of hits reported by the server is known and the following pages are
+        requested ahead in the background, so fetching the resources overlaps with finding their ids.
+
+        :param project: Project name
+        :param start_at: Start at given resource
+        :param show_n_rows: Show n resources, 0 or less to get all
+        :return: Iterator over the resource ids
         """
         max_res = 1000
 
-        nhits = None
-        all_obj_ids = []
+        def get_payload(position: int, n_rows: int) -> Dict:
+            return {
+                "searchtype": "extended",
+                "filter_by_project": project,
+                "show_nrows": n_rows,
+                "start_at": position
+            }
 
-        payload = {
-            "searchtype": "extended",
-            "filter_by_project": project
-        }
+        first_rows = max_res if show_n_rows <= 0 else min(max_res, show_n_rows)
+        nhits, obj_ids = self.get_one_obj_ids(get_payload(start_at, first_rows))
+        self.nhits = int(nhits)
 
-        if show_n_rows <= 0:
-            show_n_rows = max_res
+        logger.info("%s nhits found", self.nhits)
 
-        max_round = show_n_rows // max_res
-        cur_round = 0
-        while cur_round < max_round:
-            payload["show_nrows"] = max_res
-            payload["start_at"] = start_at + cur_round * max_res
-            nhits, obj_ids = self.get_one_obj_ids(payload)
-            all_obj_ids = all_obj_ids + obj_ids
-            cur_round = cur_round + 1
+        yield from obj_ids
 
-        leftover = show_n_rows % max_res
-        if leftover > 0:
-            payload["show_nrows"] = leftover
-            payload["start_at"] = start_at + cur_round * max_res
-            nhits, obj_ids = self.get_one_obj_ids(payload)
-            all_obj_ids = all_obj_ids + obj_ids
+        end = self.nhits if show_n_rows <= 0 else min(self.nhits, start_at + show_n_rows)
+        payloads = (get_payload(position, min(max_res, end - position))
+                    for position in range(start_at + first_rows, end, max_res))
 
-        return nhits, all_obj_ids
+        for _, obj_ids in ordered_map(self.get_one_obj_ids, payloads, workers=2):
+            yield from obj_ids
 
     def get_one_obj_ids(self, payload: Dict):
         search_url = f"{self.server}/api/search"
-        req = self.session.get(search_url, params=payload, auth=(self.user, self.password))
-        result = req.json()
-
-        if result["status"] != 0:
-            raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+        result = self.get_json(search_url, payload, stage="id paging")
 
         obj_ids = list(map(lambda a: a["obj_id"], result["subjects"]))
 
         return result["nhits"], obj_ids
 
     def get_resource(self, res_id: int) -> Dict:
-        payload = {
-            "reqtype": "info"
-        }
+        return self.get_changed_resource(res_id, {})[1]
+
+    def get_changed_resource(self, res_id: int, fingerprints: Dict[str, str]) -> Tuple:
+        """
+        Gets a resource unless it is unchanged since the previous export. The full resource is requested first
+        and compared with its fingerprint, the label is only requested for changed or new resources.
+
+        :param res_id: ID of the resource in SALSAH
+        :param fingerprints: Fingerprints of the resources of the previous export, see get_fingerprint
+        :return: SALSAH id, resource (None if it is unchanged) and fingerprint of the resource
+        """
         res_url = f"{self.server}/api/resources/{res_id}"
 
         try:
-            req = self.session.get(res_url, params=payload, auth=(self.user, self.password))
-            result = req.json()
+            result = self.get_json(res_url, stage="resource fetch")
 
-            if result["status"] != 0:
-                raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+            fingerprint = self.get_fingerprint(result)
+            if fingerprints.get(str(res_id)) == fingerprint:
+                return res_id, None, fingerprint
 
-            firstproperty = result["resource_info"]["firstproperty"]
+            if self.single_request:
+                # The full resource carries the label in its resinfo, so the 'info' request can be skipped
+                firstproperty = result.get("resinfo", {}).get("firstproperty")
+                if firstproperty is not None:
+                    result["firstproperty"] = firstproperty
+                    with self.lock:
+                        self.requests_saved += 1
+                    return res_id, result, fingerprint
 
-            req = self.session.get(res_url, auth=(self.user, self.password))
-            result = req.json()
+            # Falls back to the 'info' request if the server does not send the label with the resource
+            result["firstproperty"] = self.get_resource_label(res_url)
 
-            if result["status"] != 0:
-                raise SalsahError("SALSAH-ERROR:\n" + result["errormsg"])
+            return res_id, result, fingerprint
 
-            result["firstproperty"] = firstproperty
+        except Exception as e:
+            raise SalsahError(f"SALSAH-ERROR:\nres id {res_id} Message {e}") from e
 
-            return result
+    @staticmethod
+    def get_fingerprint(resource: Dict) -> str:
+        """
+        :param resource: Full resource as sent by the server
+        :return: Hash of the resource, which changes whenever the resource is modified
+        """
+        return hashlib.sha256(json.dumps(resource, sort_keys=True).encode("utf-8")).hexdigest()
 
-        except Exception as e:
-            print(f"{time()} {error()} res id {res_id} Message {e}")
-            exit()
+    def get_resource_label(self, res_url: str) -> str:
+        """
+        Gets the label (first property) of a resource with an 'info' request
+
+        :param res_url: URL of the resource
+        :return: Label of the resource
+        """
+        payload = {
+            "reqtype": "info"
+        }
+        result = self.get_json(res_url, payload, stage="resource fetch")
+
+        return result["resource_info"]["firstproperty"]
 
     def write_to_json(self, proj: Dict):
         """
         We send the dict to JSON and write it to the project-folder
         """
-        json_filename = self.filename + ".json"
+        json_filename = compressed_filename(self.filename + ".json", self.compression)
         file_content = json.dumps(proj, indent=4)
-        f = open(json_filename, "w")
+        f = open_output(json_filename, "w", self.compression)
         f.write(file_content)
         f.close()
 
-    def process_value(self, val_type: int, value: any, verbose: bool, counter: int, comment: str = None):
-        val_element = None
-        csv_values = {}
-
-        if val_type == ValtypeMap.TEXT.value:
-            if value:
-                val_element = etree.Element("text")
-                val_element.text = value.replace("\"", "'").replace("<", "").replace(">", "")
-                val_element.set("encoding", "utf8")
-                # TODO: replace characters in value
-                csv_values[f"{counter}_value"] = value
-                csv_values[f"{counter}_encoding"] = "utf8"
-
-                if verbose:
-                    print(f"{log()} text -> '{value}'")
-        elif val_type == ValtypeMap.RICHTEXT.value:
-            if value.get("utf8str").strip():
-                encoding, rich_text = process_rich_text(
-                    utf8str=value.get("utf8str").strip(),
-                    projectname=self.projectname,
-                    textattr=value.get("textattr").strip(),
-                    resptrs=value.get("resptrs")
-                    )
-
-                val_element = etree.Element("text")
-                val_element.text = rich_text
-                val_element.set("encoding", encoding)
-                csv_values[f"{counter}_value"] = rich_text
-                csv_values[f"{counter}_encoding"] = encoding
-
-                resrefs = "|".join(value["resource_reference"])
-                if len(resrefs) > 0:
-                    val_element.set("resrefs", resrefs)
-                    csv_values[f"{counter}_res ref"] = resrefs
-
-                if verbose:
-                    print(f"{log()} richtext -> '{value.get('utf8str').strip()}'")
-        elif val_type == ValtypeMap.COLOR.value:
-            if value:
-                val_element = etree.Element("color")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} color -> '{value}'")
-        elif val_type == ValtypeMap.DATE.value:
-            if value:
-                val_element = etree.Element("date")
-                cal: str
-                start: Tuple[int, int, int, float]
-                end: Tuple[int, int, int, float]
-                if value["calendar"] == "GREGORIAN":
-                    cal = "GREGORIAN"
-                    start = jdcal.jd2gcal(float(value["dateval1"]), 0.0)
-                    end = jdcal.jd2gcal(float(value["dateval2"]), 0.0)
-                else:
-                    cal = "JULIAN"
-                    start = jdcal.jd2jcal(float(value["dateval1"]), 0.0)
-                    end = jdcal.jd2jcal(float(value["dateval2"]), 0.0)
-                p1: str = "CE"
-                if start[0] <= 0:
-                    start = (start[0] - 1, start[1], start[2], start[3])
-                    p1 = "BCE"
-
-                p2: str = "CE"
-                if end[0] <= 0:
-                    end = (end[0] - 1, end[1], end[2], end[3])
-                    p2 = "BCE"
-
-                startstr: str = ""
-                endstr: str = ""
-
-                if value["dateprecision1"] == "YEAR":
-                    startstr = "{}:{}:{:04d}".format(cal, p1, start[0])
-                elif value["dateprecision1"] == "MONTH":
-                    startstr = "{}:{}:{:04d}-{:02d}".format(cal, p1, start[0], start[1])
-                else:
-                    startstr = "{}:{}:{:04d}-{:02d}-{:02d}".format(cal, p1, start[0], start[1], start[2])
-
-                if value["dateprecision2"] == "YEAR":
-                    if start[0] != end[0]:
-                        endstr = ":{}:{:04d}".format(p2, end[0])
-                elif value["dateprecision2"] == "MONTH":
-                    if start[0] != end[0] or start[1] != end[1]:
-                        endstr = ":{}:{:04d}-{:02d}".format(p2, end[0], end[1])
-                else:
-                    if start[0] != end[0] or start[1] != end[1] or start[2] != end[2]:
-                        endstr = ":{}:{:04d}-{:02d}-{:02d}".format(p2, end[0], end[1], end[2])
-
-                val_element.text = f"{startstr}{endstr}"
-                csv_values[f"{counter}_value"] = f"{startstr}{endstr}"
-
-                if verbose:
-                    print(f"{log()} date -> '{value}'")
-        elif val_type == ValtypeMap.FLOAT.value:
-            if value:
-                val_element = etree.Element("float")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} float -> '{value}'")
-        elif val_type == ValtypeMap.GEOMETRY.value:
-            if value:
-                val_element = etree.Element("geometry")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} geometry -> '{value}'")
-        elif val_type == ValtypeMap.GEONAME.value:
-            if value:
-                val_element = etree.Element("geoname")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} geoname -> '{value}'")
-        elif val_type == ValtypeMap.HLIST.value:
-            if value:
-                val_element = etree.Element("list")
-                # hlist references have to start like "H_6615"
-                val_element.text = f"H_{value}"
-                csv_values[f"{counter}_value"] = f"H_{value}"
-
-                if verbose:
-                    print(f"{log()} hlist -> '{value}'")
-        elif val_type == ValtypeMap.ICONCLASS.value:
-            if value:
-                val_element = etree.Element("iconclass")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} icon class -> '{value}'")
-        elif val_type == ValtypeMap.INTEGER.value:
-            if value:
-                val_element = etree.Element("integer")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} integer -> '{value}'")
-        elif val_type == ValtypeMap.INTERVAL.value:
-            if value:
-                val_element = etree.Element("interval")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} interval -> '{value}'")
-        elif val_type == ValtypeMap.PERIOD.value:
-            if value:
-                val_element = etree.Element("period")
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} period -> '{value}'")
-        elif val_type == ValtypeMap.RESPTR.value:
-            if value:
-                val_element = etree.Element("resptr")
-                # resource references have to start with the project name e.g. "webern_11111"
-                val_element.text = f"{self.projectname}_{value}"
-                csv_values[f"{counter}_value"] = f"{self.projectname}_{value}"
-
-                if verbose:
-                    print(f"{log()} resptr -> '{value}'")
-        elif val_type == ValtypeMap.SELECTION.value:
-            if value:
-                val_element = etree.Element("list")
-                # selection references have to start like "S_6615"
-                val_element.text = f"S_{value}"
-                csv_values[f"{counter}_value"] = f"S_{value}"
-
-                if verbose:
-                    print(f"{log()} list -> '{value}'")
-        elif val_type == ValtypeMap.TIME.value:
-            if value:
-                val_element = etree.Element("time")
-                val_element.text = value
-                csv_values[f"{counter}_value"] = value
-
-                if verbose:
-                    print(f"{log()} time -> '{value}'")
-        else:
-            print(f"{warning()} Value type not found")
+    def register_value_converter(self, val_type: int, converter: "ValueConverter") -> None:
+        """
+        Registers the converter for the values of a value type. Projects can replace the default converters with
+        their own ones.
+
+        :param val_type: Value type, see ValtypeMap
+        :param converter: Converter for the values
+        """
+        self.value_converters[val_type] = converter
+
+    def register_default_value_converters(self) -> None:
+        self.register_value_converter(ValtypeMap.TEXT.value, TextConverter("text"))
+        self.register_value_converter(ValtypeMap.RICHTEXT.value, RichtextConverter("richtext", self.projectname))
+        self.register_value_converter(ValtypeMap.COLOR.value, ValueConverter("color"))
+        self.register_value_converter(ValtypeMap.DATE.value, DateConverter("date"))
+        self.register_value_converter(ValtypeMap.FLOAT.value, ValueConverter("float"))
+        self.register_value_converter(ValtypeMap.GEOMETRY.value, ValueConverter("geometry"))
+        self.register_value_converter(ValtypeMap.GEONAME.value, ValueConverter("geoname"))
+        # hlist references have to start like "H_6615"
+        self.register_value_converter(ValtypeMap.HLIST.value, ValueConverter("hlist", tag="list", prefix="H_"))
+        self.register_value_converter(ValtypeMap.ICONCLASS.value, ValueConverter("icon class", tag="iconclass"))
+        self.register_value_converter(ValtypeMap.INTEGER.value, ValueConverter("integer"))
+        self.register_value_converter(ValtypeMap.INTERVAL.value, ValueConverter("interval"))
+        self.register_value_converter(ValtypeMap.PERIOD.value, PeriodConverter("period"))
+        # resource references have to start with the project name e.g. "webern_11111"
+        self.register_value_converter(ValtypeMap.RESPTR.value, ValueConverter("resptr", prefix=f"{self.projectname}_"))
+        # selection references have to start like "S_6615"
+        self.register_value_converter(ValtypeMap.SELECTION.value, ValueConverter("list", prefix="S_"))
+        self.register_value_converter(ValtypeMap.TIME.value, ValueConverter("time"))
+
+    def process_value(self, val_type: int, value: any, counter: int, comment: str = None):
+        converter = self.value_converters.get(val_type)
+        if converter is None:
+            logger.warning("Value type %s not found", val_type)
+            return None, {}
+
+        val_element, csv_values = converter.convert(value, counter)
+        if val_element is None:
+            return None, csv_values
+
+        # describe is only worth calling if the message is logged
+        if value_logger.isEnabledFor(logging.DEBUG):
+            value_logger.debug("%s -> '%s'", converter.name, converter.describe(value))
 
         # Adds the comment for the value
         if comment is not None:
             val_element.set("comment", comment)
             csv_values[f"{counter}_comment"] = comment
 
-            if verbose:
-                print(f"{log()} Comment for value: {comment}")
+            value_logger.debug("Comment for value: %s", comment)
 
         # Adds default permission for property
-        if val_element is not None:
-            val_element.set("permissions", "prop-default")
-            csv_values[f"{counter}_permissions"] = "prop-default"
+        val_element.set("permissions", "prop-default")
+        csv_values[f"{counter}_permissions"] = "prop-default"
 
         return val_element, csv_values
 
-    def process_property(self, prop_name: str, prop: Dict, res_type_name: str, verbose: bool):
-        if prop_name == "__location__":
-            return None, None
+    def get_property_name(self, prop_name: str, res_type_name: str) -> str:
+        """
+        Maps the name of a SALSAH property to the name of the property in the data XML
 
-        if prop.get("values") is not None:
-            # Strips off the vocabulary, if it's not salsah, dc, etc.
-            tmp = prop_name.split(":")
-            new_prop_name: str
-            if tmp[0] == self.vocabulary or tmp[0] == "dc":
-                # if the prop_name does not start with "has" or is, add it to the prop_name. We have to do this
-                # to avoid naming conflicts between resources and properties which share the same
-                # namespace in GraphDB
+        :param prop_name: Name of the property with the vocabulary, e.g. "webern:title"
+        :param res_type_name: Name of the resource type of the resource the property belongs to
+        :return: Name of the property, e.g. "hasTitle"
+        """
+        # Strips off the vocabulary, if it's not salsah, dc, etc.
+        tmp = prop_name.split(":")
+        new_prop_name: str
+        if tmp[0] == self.vocabulary or tmp[0] == "dc":
+            # if the prop_name does not start with "has" or is, add it to the prop_name. We have to do this
+            # to avoid naming conflicts between resources and properties which share the same
+            # namespace in GraphDB
+            new_prop_name = self.prepare_property_name(tmp[1])
+        else:
+            if tmp[1] == "comment_rt" or tmp[1] == "comment":
                 new_prop_name = self.prepare_property_name(tmp[1])
-            else:
-                if tmp[1] == "comment_rt" or tmp[1] == "comment":
-                    new_prop_name = self.prepare_property_name(tmp[1])
-                elif tmp[1] == "lastname" or tmp[1] == "firstname":
-                    new_prop_name = self.prepare_property_name(tmp[1])
-                elif tmp[1] == "part_of":
-                    if self.resptrs.get(res_type_name) is not None:
-                        tmp = self.resptrs.get(res_type_name)
-                        if tmp.get("salsah:part_of") is not None:
-                            knora_object = camel_case_vocabulary_resource(tmp["salsah:part_of"])
-                            new_prop_name = "isPartOf" + knora_object.replace(self.vocabulary + ":", "")
-                        else:
-                            raise SalsahError("'salsah:part_of' is missing in the resptrs.xml!")
-
+            elif tmp[1] == "lastname" or tmp[1] == "firstname":
+                new_prop_name = self.prepare_property_name(tmp[1])
+            elif tmp[1] == "part_of":
+                if self.resptrs.get(res_type_name) is not None:
+                    tmp = self.resptrs.get(res_type_name)
+                    if tmp.get("salsah:part_of") is not None:
+                        knora_object = camel_case_vocabulary_resource(tmp["salsah:part_of"])
+                        new_prop_name = "isPartOf" + knora_object.replace(self.vocabulary + ":", "")
                     else:
-                        raise SalsahError("'part_of' property was not defined and mapped in an external xml file!")
-                elif tmp[1] == "seqnum":
-                    new_prop_name = self.prepare_property_name(tmp[1])
-                elif tmp[1] == "transcription":
-                    new_prop_name = self.prepare_property_name(tmp[1])
+                        raise SalsahError("'salsah:part_of' is missing in the resptrs.xml!")
+
                 else:
-                    new_prop_name = prop_name
+                    raise SalsahError("'part_of' property was not defined and mapped in an external xml file!")
+            elif tmp[1] == "seqnum":
+                new_prop_name = self.prepare_property_name(tmp[1])
+            elif tmp[1] == "transcription":
+                new_prop_name = self.prepare_property_name(tmp[1])
+            else:
+                new_prop_name = prop_name
+
+        return new_prop_name
+
+    def map_property_names(self, restype_infos: Iterable[Dict]) -> None:
+        """
+        Maps the names of the properties of the resource types once, so process_property only has to look them up
+
+        :param restype_infos: Resource types of the vocabulary as returned by the SALSAH API
+        """
+        for restype_info in restype_infos:
+            for property in restype_info["properties"]:
+                prop_name = f"{property['vocabulary']}:{property['name']}"
+                try:
+                    self.property_names[(prop_name, restype_info["name"])] = self.get_property_name(
+                        prop_name, restype_info["name"])
+                except SalsahError:
+                    # Missing mappings are only an error if a resource uses the property
+                    pass
+
+    def process_property(self, prop_name: str, prop: Dict, res_type_name: str):
+        if prop_name == "__location__":
+            return None, None
+
+        if prop.get("values") is not None:
+            # The names of the properties of the ontology are mapped in get_ontology, other names on first use
+            new_prop_name = self.property_names.get((prop_name, res_type_name))
+            if new_prop_name is None:
+                new_prop_name = self.get_property_name(prop_name, res_type_name)
+                self.property_names[(prop_name, res_type_name)] = new_prop_name
 
             xml_prop: Dict[str, str] = {
                 "name": f":{new_prop_name}"
@@ -1311,8 +2959,8 @@ class Salsah:
             for value in prop["values"]:
                 value_counter += 1
                 if prop["comments"][cnt]:
-                    val_element, csv_value = self.process_value(int(prop["valuetype_id"]), value, verbose,
-                                                                value_counter, prop["comments"][cnt])
+                    val_element, csv_value = self.process_value(int(prop["valuetype_id"]), value, value_counter,
+                                                                prop["comments"][cnt])
                     if val_element is not None:
                         prop_element.append(val_element)
                         cnt += 1
@@ -1322,8 +2970,7 @@ class Salsah:
                     else:
                         value_counter -= 1
                 else:
-                    val_element, csv_value = self.process_value(int(prop["valuetype_id"]), value, verbose,
-                                                                value_counter)
+                    val_element, csv_value = self.process_value(int(prop["valuetype_id"]), value, value_counter)
                     if val_element is not None:
                         prop_element.append(val_element)
                         cnt += 1
@@ -1334,9 +2981,7 @@ class Salsah:
                         value_counter -= 1
             if cnt > 0:
                 # Updates the global maximum of values found
-                global max_values
-                if max_values < value_counter:
-                    max_values = value_counter
+                self.update_max_values(value_counter)
 
                 return prop_element, csv_prop
             else:
@@ -1344,13 +2989,66 @@ class Salsah:
         else:
             return None, None
 
-    def process_resource(self, resource: Dict, download: bool, verbose: bool):
+    def get_image_location(self, resource: Dict):
+        """
+        Gets the location of the image file of a resource
+
+        :param resource: Resource as returned by get_resource
+        :return: URL for downloading the image file and its path on the local disk, None if there is no image file
+        """
+        if resource["resinfo"].get("locdata") is None:
+            return None
+
+        imag_path = os.path.join(self.images_path, resource["resinfo"]["locdata"]["origname"])
+        ext = os.path.splitext(resource["resinfo"]["locdata"]["origname"])[1][1:].strip().lower()
+        if ext == "jpg" or ext == "jpeg":
+            img_format = "jpg"
+        elif ext == "png":
+            img_format = "png"
+        elif ext == "jp2" or ext == "jpx":
+            img_format = "jpx"
+        else:
+            img_format = "tif"
+        getter = f"{resource['resinfo']['locdata']['path']}&format={img_format}"
+
+        return getter, imag_path
+
+    def process_resource(self, resource: Dict, download: bool, updated: bool = False):
+        if not self.add_resource(resource, download, updated):
+            return None, None
+
+        return self.convert_resource(resource)
+
+    def add_resource(self, resource: Dict, download: bool, updated: bool = False) -> bool:
+        """
+        Marks a resource as added and hands its image file over to the download stage
+
+        :param resource: Resource as returned by get_resource
+        :param download: Downloads the image file of the resource
+        :param updated: The resource changed since the previous export, see ExportContext.add
+        :return: False if the resource was already added
+        """
         # Creates resource id and checks if was already added
         res_id = f"{self.projectname}_{resource['resdata']['res_id']}"
-        if res_id in allResAdded:
-            return None, None
-        else:
-            allResAdded[res_id] = True
+        if not self.context.add(res_id, updated):
+            return False
+
+        # Hands the image file over to the download stage, which runs in the background
+        image_location = self.get_image_location(resource)
+        if download and image_location is not None:
+            self.downloader.submit(*image_location)
+
+        return True
+
+    def convert_resource(self, resource: Dict):
+        """
+        Converts a resource into its XML element and CSV rows. This only depends on the state collected with
+        the ontology, so it can also run in a worker process, see transform_resource.
+
+        :param resource: Resource as returned by get_resource
+        :return: Resource element and list of CSV rows
+        """
+        res_id = f"{self.projectname}_{resource['resdata']['res_id']}"
 
         # Creates resource type
         tmp = resource["resdata"]["restype_name"].split(":")
@@ -1377,27 +3075,9 @@ class Salsah:
         # Creates xml element "resource" with the attributes
         res_element = etree.Element("resource", res_attributes)
 
-        if resource["resinfo"].get("locdata") is not None:
-            imag_path = os.path.join(self.images_path, resource["resinfo"]["locdata"]["origname"])
-            ext = os.path.splitext(resource["resinfo"]["locdata"]["origname"])[1][1:].strip().lower()
-            if ext == "jpg" or ext == "jpeg":
-                img_format = "jpg"
-            elif ext == "png":
-                img_format = "png"
-            elif ext == "jp2" or ext == "jpx":
-                img_format = "jpx"
-            else:
-                img_format = "tif"
-            getter = f"{resource['resinfo']['locdata']['path']}&format={img_format}"
-
-            if download:
-                print(f"{time()} Downloading {resource['resinfo']['locdata']['origname']}...")
-                dlfile2 = self.session.get(getter, stream=True)  # war urlretrieve()
-
-                with open(imag_path, "w+b") as fd:
-                    for chunk in dlfile2.iter_content(chunk_size=128):
-                        fd.write(chunk)
-                    fd.close()
+        image_location = self.get_image_location(resource)
+        if image_location is not None:
+            getter, imag_path = image_location
 
             # Creates xml element "bitstream" with the image path and appends to the "resource" element
             image_element = etree.Element("bitstream")
@@ -1411,7 +3091,7 @@ class Salsah:
         csv_res: List = [res_attributes]
 
         for prop_name in resource["props"]:
-            prop_element, csv_prop = self.process_property(prop_name, resource["props"][prop_name], resource["resdata"]["restype_name"], verbose)
+            prop_element, csv_prop = self.process_property(prop_name, resource["props"][prop_name], resource["resdata"]["restype_name"])
 
             # Skips iteration if no properties received
             if prop_element is None or csv_prop is None:
@@ -1422,47 +3102,232 @@ class Salsah:
             # Adds the prop attributes to the res attributes
             csv_res.append(csv_prop)
 
-        if verbose:
-            print(f"{log()} resource ID={resource['resdata']['res_id']} added")
+        logger.debug("resource ID=%s added", resource["resdata"]["res_id"], extra={"res_id": res_id})
 
         return res_element, csv_res
 
-    def get_data(self, project, nrows, start, download, verbose):
-        # Empty list for csv data initialized
-        csv_data: List = []
-        # Root element for xml data initialized
-        xml_data = self.get_root_element()
-
-        # Gets the amount of resources and all the resource ids
-        nhits, res_ids = self.get_all_obj_ids(project, nrows, start)
-
-        print(f"{time()} {nhits} nhits found")
+    def get_transform_state(self) -> Dict:
+        """
+        Collects everything a worker process needs to convert resources, see init_transform_worker
 
-        # Gets all the resources of the project
-        resources = list(map(self.get_resource, res_ids))
+        :return: Picklable state of this object
+        """
+        return {
+            "args": {
+                "server": self.server,
+                "user": "",
+                "password": "",
+                "filename": self.filename,
+                "assets_path": self.assets_path,
+                "images_path": self.images_path,
+                "projectname": self.projectname,
+                "shortcode": self.shortcode,
+                "resptrs": self.resptrs,
+                "permissions": {},
+                "session": None
+            },
+            "vocabulary": self.vocabulary,
+            "selection_mapping": self.selection_mapping,
+            "selection_node_mapping": self.selection_node_mapping,
+            "hlist_mapping": self.hlist_mapping,
+            "hlist_node_mapping": self.hlist_node_mapping,
+            "property_names": self.property_names,
+            "value_converters": self.value_converters,
+            "log_level": logger.level,
+            "log_sample": next((f.n for f in value_logger.filters if isinstance(f, SamplingFilter)), 1)
+        }
 
-        # Processes through all the resources and saves them in the salsah object.
-        # Once in the xml_root for the xml file and once in the csv_data for the csv file
+    def transform(self, resources: Iterable, download: bool, since: Dict[str, str] = None) -> Iterator:
+        """
+        Converts the resources into XML fragments and CSV rows. With processes > 0, the conversion runs in a
+        process pool which gets the mapping state once at startup.
+
+        :param resources: Iterable of (SALSAH id, resource)
+        :param download: Downloads the image files of the resources
+        :param since: Fingerprints of the previous export, the resources in it are updates of that export
+        :return: Iterator of (SALSAH id, XML fragment, CSV rows, image location), fragment and rows are None for
+                 resources which were already added
+        """
+        since = since or {}
+
+        if self.processes <= 0:
+            for res_id, resource in resources:
+                start = perf_counter()
+                res_element, csv_res = self.process_resource(resource, download, str(res_id) in since)
+                if res_element is None or csv_res is None:
+                    yield res_id, None, None, None
+                else:
+                    fragment = XmlWriter.serialize(res_element)
+                    self.metrics.record("conversion", perf_counter() - start)
+                    yield res_id, fragment, csv_res, self.get_image_location(resource)
+            return
+
+        # Checks for duplicates in this process, only the new resources are sent to the workers
+        def add_resources() -> Iterator:
+            for res_id, resource in resources:
+                yield res_id, resource if self.add_resource(resource, download, str(res_id) in since) else None
+
+        # The messages of the workers are written by a listener in this process
+        log_queue = multiprocessing.Queue()
+        log_listener = add_log_listener(log_queue)
+        try:
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=init_transform_worker,
+                                     initargs=(self.get_transform_state(), log_queue)) as executor:
+                for res_id, fragment, csv_res, image_location, worker_max_values, seconds in ordered_map(
+                        transform_resource, add_resources(), self.processes, executor=executor):
+                    self.update_max_values(worker_max_values)
+                    if fragment is not None:
+                        self.metrics.record("conversion", seconds)
+                    yield res_id, fragment, csv_res, image_location
+        finally:
+            log_listener.stop()
+
+    def get_data(self, project, nrows, start, download, declared_max_values: int = None, resume: bool = False,
+                 since: Dict[str, str] = None, shard_size: Tuple[int, bool] = None, outputs: List[str] = None):
+        """
+        Gets all the resources of the project and writes them to the XML and CSV file as soon as they are processed.
+        Every exported resource is recorded in a journal, which lets an interrupted export be resumed. The
+        fingerprints of the resources are saved for the next export, which can then be limited to the changes.
+
+        :param declared_max_values: Maximum number of values per property if known upfront, see CsvWriter
+        :param resume: Continues the export recorded in the journal instead of starting over
+        :param since: Fingerprints of the previous export. Only new and changed resources are written, and the
+                      resources which no longer exist are listed in a deletions file
+        :param shard_size: Maximum number of resources (or bytes, if the flag is set) per part of the data XML, see
+                           ShardedXmlWriter. None writes a single XML file
+        :param outputs: Additional outputs written from the same resources, see output_backends
+        """
+        # Writers for the xml and csv data initialized
+        if shard_size is None:
+            xml_writer = XmlWriter(f"{self.filename}.xml", self.get_root_element(), self.compression)
+        else:
+            xml_writer = ShardedXmlWriter(self.filename, self.get_root_element(), *shard_size,
+                                          compression=self.compression)
+        csv_writer = CsvWriter(f"{self.filename}.csv", declared_max_values, self.compression)
+        backends: List[OutputBackend] = [output_backends[output](self.filename, self.compression)
+                                         for output in dict.fromkeys(outputs or [])]
+        journal = ExportJournal(f"{self.filename}.journal")
+        # Download stage for the image files initialized
+        if download:
+            self.downloader = ImageDownloader(self.request, self.download_workers, f"{self.filename}-images.jsonl",
+                                              self.metrics, self.verify_images)
+
+        # Fingerprints of all the resources of this export
+        fingerprints: Dict[str, str] = {}
+
+        # Replays the resources of the interrupted export. They are written again without contacting the server
+        exported_ids: set = set()
         res_counter = 0
-        for resource in resources:
-            res_element, csv_res = self.process_resource(resource, download, verbose)
+        if resume:
+            for entry in journal.load():
+                exported_ids.add(entry["res_id"])
+                if entry.get("fingerprint") is not None:
+                    fingerprints[entry["res_id"]] = entry["fingerprint"]
+                    self.context.add(f"{self.projectname}_{entry['res_id']}")
+                if entry["xml"] is not None:
+                    self.context.add(f"{self.projectname}_{entry['res_id']}")
+                    xml_writer.write_fragment(entry["xml"].encode("utf-8"))
+                    csv_writer.write(entry["csv"])
+                    for backend in backends:
+                        backend.write(entry["csv"])
+                    res_counter += 1
+                    # Completes the downloads of the interrupted export, finished files are skipped
+                    if download and entry["image"] is not None:
+                        self.downloader.submit(*entry["image"])
+                self.update_max_values(entry["max_values"])
+
+            logger.info("%d resources taken from the journal", len(exported_ids))
+
+        journal.open(append=resume)
+
+        # Gets the resource ids page by page, skipping the resources which were already exported
+        all_ids: set = set()
+
+        def get_res_ids() -> Iterator:
+            for res_id in self.iter_obj_ids(project, nrows, start):
+                all_ids.add(str(res_id))
+                if str(res_id) not in exported_ids:
+                    yield res_id
+
+        # Gets all the resources of the project while their ids arrive. They are fetched concurrently, but arrive
+        # in the order of the ids
+        fetched = ordered_map(lambda res_id: self.get_changed_resource(res_id, since or {}), get_res_ids(),
+                              self.workers)
+
+        # Records the resources which are unchanged since the previous export, the others are processed
+        unchanged = 0
+
+        def get_resources() -> Iterator:
+            nonlocal unchanged
+            for res_id, resource, fingerprint in fetched:
+                fingerprints[str(res_id)] = fingerprint
+                if resource is None:
+                    self.context.add(f"{self.projectname}_{res_id}")
+                    journal.record(str(res_id), max_values=self.max_values, fingerprint=fingerprint)
+                    unchanged += 1
+                    continue
+                yield res_id, resource
+
+        # Processes through all the resources. Each resource is written to the xml and csv file right away
+        for res_id, fragment, csv_res, image_location in self.transform(get_resources(), download, since):
+            fingerprint = fingerprints[str(res_id)]
 
             # Skips iteration if no resources received
-            if res_element is None or csv_data is None:
+            if fragment is None or csv_res is None:
+                journal.record(str(res_id), max_values=self.max_values, fingerprint=fingerprint)
                 continue
 
-            # Appends the res element to the root element
-            xml_data.append(res_element)
-            # Concatenates the res (including props) with the existing data
-            csv_data = csv_data + csv_res
+            # Writes the res element to the xml file
+            write_start = perf_counter()
+            xml_writer.write_fragment(fragment)
+            self.metrics.record("xml write", perf_counter() - write_start, len(fragment) + 3)
+            # Writes the res (including props) to the csv file
+            write_start = perf_counter()
+            csv_writer.write(csv_res)
+            self.metrics.record("csv write", perf_counter() - write_start)
+            # Writes the res to the additional outputs
+            if backends:
+                write_start = perf_counter()
+                for backend in backends:
+                    backend.write(csv_res)
+                self.metrics.record("output write", perf_counter() - write_start)
+            # Records the resource as exported
+            journal.record(str(res_id), fragment, csv_res, image_location, self.max_values, fingerprint)
 
             res_counter += 1
 
             # Prints counter after every 1000th resources processed
             if res_counter % 1000 == 0:
-                print(f"{time()} resource no. {res_counter} processed...")
+                logger.info("resource no. %d processed...", res_counter)
+
+        save(f"{self.filename}-fingerprints.json", fingerprints, self.compression)
+
+        if since is not None:
+            logger.info("%d resources unchanged since the previous export", unchanged)
+            # Only a complete listing shows which resources no longer exist
+            if nrows <= 0 and start == 0:
+                deleted = [res_id for res_id in since if res_id not in all_ids]
+                save(f"{self.filename}-deletions.json", deleted, self.compression)
+                logger.info("%d resources deleted since the previous export", len(deleted))
+            else:
+                logger.warning("Deletions are only detected when all the resources are exported")
+
+        journal.close()
+        xml_writer.close()
+        csv_writer.close(self.max_values)
+        for backend in backends:
+            backend.close()
 
-        return xml_data, csv_data
+        # Waits for the image files still being downloaded
+        if download:
+            logger.info("Waiting for the image downloads...")
+            self.downloader.close()
+
+        # All the output is written, so the export no longer needs to be resumed
+        journal.remove()
+
+        if self.single_request:
+            logger.info("%d requests saved by fetching the labels with the resources", self.requests_saved)
 
     def get_root_element(self):
         # Prepares namespaces for xml root element
@@ -1492,33 +3357,138 @@ class Salsah:
 
         return root_element
 
-    def write_to_xml(self, data):
-        xml_filename = f"{self.filename}.xml"
-        f = open(xml_filename, "w")
-        f.write(etree.tostring(data, pretty_print=True, xml_declaration=True, encoding="utf-8").decode("utf-8").replace("&lt;", "<").replace("&gt;", ">"))
-        f.close()
 
-    def write_to_csv(self, data):
-        row_headers = ["id", "restype", "label", "ark", "permissions", "file", "prop name", "prop type", "prop list"]
+# Salsah object of a worker process of the transformation stage, see init_transform_worker
+transform_salsah: Salsah = None
 
-        global max_values
-        for counter in range(max_values):
-            row_headers.append(f"{counter + 1}_value")
-            row_headers.append(f"{counter + 1}_encoding")
-            row_headers.append(f"{counter + 1}_res ref")
-            row_headers.append(f"{counter + 1}_permissions")
-            row_headers.append(f"{counter + 1}_comment")
 
-        csv_filename = f"{self.filename}.csv"
-        with open(csv_filename, "w", encoding="utf8", newline="") as f:
-            writer = csv.DictWriter(f, delimiter=";", fieldnames=row_headers)
-            writer.writeheader()
-            writer.writerows(data)
+def init_transform_worker(state: Dict, log_queue) -> None:
+    """
+    Initializes a worker process of the transformation stage with the state of the main process
+
+    :param state: State as returned by Salsah.get_transform_state
+    :param log_queue: Queue for the messages of the worker, see add_log_listener
+    """
+    global transform_salsah
+    configure_loggers(QueueHandler(log_queue), state["log_level"], state["log_sample"])
+    transform_salsah = Salsah(**state["args"])
+    transform_salsah.vocabulary = state["vocabulary"]
+    transform_salsah.selection_mapping = state["selection_mapping"]
+    transform_salsah.selection_node_mapping = state["selection_node_mapping"]
+    transform_salsah.hlist_mapping = state["hlist_mapping"]
+    transform_salsah.hlist_node_mapping = state["hlist_node_mapping"]
+    transform_salsah.property_names = state["property_names"]
+    transform_salsah.value_converters = state["value_converters"]
+
+
+def transform_resource(item: Tuple) -> Tuple:
+    """
+    Converts a resource in a worker process. lxml objects can't be pickled, so the resource is returned as
+    serialized XML fragment.
+
+    :param item: SALSAH id and resource, None if the resource was already added
+    :return: SALSAH id, XML fragment, CSV rows, image location, the maximum number of values in this worker and
+             the time of the conversion
+    """
+    res_id, resource = item
+    if resource is None:
+        return res_id, None, None, None, transform_salsah.max_values, 0.0
+
+    start = perf_counter()
+    res_element, csv_res = transform_salsah.convert_resource(resource)
+    fragment = XmlWriter.serialize(res_element)
+    return (res_id, fragment, csv_res, transform_salsah.get_image_location(resource),
+            transform_salsah.max_values, perf_counter() - start)
+
+
+def serve_metrics(port: int, con: Salsah, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the metrics of the export in the Prometheus text format on /metrics, while the export is running
+
+    :param port: Port to listen on
+    :param con: Salsah object of the export
+    :param host: Address to listen on, only local connections by default
+    :return: Server running in a background thread
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = con.metrics.to_prometheus(con.latency).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def param_timeouts(args) -> Dict:
+    timeouts: Dict = dict(endpoint_timeouts)
+    for timeout in args.timeout or []:
+        try:
+            endpoint, seconds = timeout.split("=")
+            timeouts[endpoint] = (timeouts["default"][0], float(seconds))
+        except ValueError:
+            logger.error("Timeouts must be given as ENDPOINT=SECONDS, e.g. '--timeout search=120'")
+            exit()
+
+    return timeouts
+
+
+class JitterRetry(Retry):
+    """
+    Retry adding a random jitter of up to one backoff factor to every backoff, so concurrent requests failing at
+    the same time don't retry at the same time. urllib3 1.26 has no backoff_jitter argument.
+    """
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, self.backoff_factor)
+
+
+def make_session(pool_size: int, retries: int, backoff: float) -> requests.Session:
+    """
+    Creates the session for the requests to the SALSAH server. Connections are kept alive in a pool, and
+    failed requests are retried with an exponential backoff with jitter.
+
+    :param pool_size: Number of connections kept open, should match the number of concurrent requests
+    :param retries: Number of retries for connection errors and 5xx responses
+    :param backoff: Backoff factor in seconds, the n-th retry waits backoff * 2^(n-1) seconds plus jitter
+    :return: Session object
+    """
+    retry = JitterRetry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        status_forcelist=[500, 502, 503, 504],
+        backoff_factor=backoff
+    )
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    # Skips verification (Use it only for local requests)
+    session.verify = False
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
 
 
 def param_project(args):
     if args.project is None:
-        print(f"{error()} You must give a shortname or ID of a project")
+        logger.error("You must give a shortname or ID of a project")
         exit()
     else:
         return args.project
@@ -1534,12 +3504,12 @@ def param_shortcode(args):
             parts = line.split(",")
             if len(parts) > 1 and parts[1] == args.project:
                 shortcode = parts[0]
-                print(f"{time()} Found Knora project shortcode '{shortcode}' for '{parts[1]}'!")
+                logger.info("Found Knora project shortcode '%s' for '%s'!", shortcode, parts[1])
     else:
         shortcode = args.shortcode
 
     if shortcode is None:
-        print(f"{error()} You must pass a shortcode ('--shortcode XXXX')!")
+        logger.error("You must pass a shortcode ('--shortcode XXXX')!")
         exit()
 
     return shortcode
@@ -1550,7 +3520,7 @@ def param_credentials(args):
     pwd = args.password
 
     if user is None or pwd is None:
-        print(f"{error()} You must pass a user and password ('--user XXX --password YYYY)")
+        logger.error("You must pass a user and password ('--user XXX --password YYYY)")
         exit()
 
     return user, pwd
@@ -1569,7 +3539,7 @@ def param_resptrs(args, parser):
                     props[prop.attrib["name"]] = prop.text.strip()
                 resptrs[restype_name] = props
         else:
-            print(f"{warning()} No resources specified in given file: '{args.resptrs_file}'!")
+            logger.warning("No resources specified in given file: '%s'!", args.resptrs_file)
 
     return resptrs
 
@@ -1584,24 +3554,76 @@ def param_permissions(args, parser):
                 permission_name = permission.attrib["id"].strip()
                 permissions[permission_name] = permission
         else:
-            print(f"{warning()} No permissions specified in given file: '{args.permissions_file}'!")
+            logger.warning("No permissions specified in given file: '%s'!", args.permissions_file)
 
     return permissions
 
 
-def get_ids_from_file(args):
+def param_shard_size(args):
+    if args.shard_size is None:
+        return None
+
+    # A plain number is the number of resources, a number with a unit (KB, MB, GB) the size in bytes
+    units: Dict = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+    size: str = args.shard_size.strip().upper()
+    try:
+        if size[-2:] in units:
+            shard_size = (int(float(size[:-2]) * units[size[-2:]]), True)
+        else:
+            shard_size = (int(size), False)
+    except ValueError:
+        shard_size = (0, False)
+
+    if shard_size[0] <= 0:
+        logger.error("Invalid shard size '%s', use a number of resources or a size like 500MB", args.shard_size)
+        exit()
+
+    return shard_size
+
+
+def param_since(args):
+    if args.since is None:
+        return None
+
+    try:
+        with open_input(args.since) as f:
+            return json.load(f)
+    except ValueError:
+        logger.error("File is not a JSON file or does not contain an object.")
+        exit()
+    except OSError:
+        logger.error("Couldn't open %s. Check path file and try it again", args.since)
+        exit()
+
+
+def get_ids_from_file(args) -> IdStore:
     if args.ids_file is not None:
         try:
-            with open(args.ids_file) as ids_added:
-                return json.load(ids_added)
+            if IdStore.is_store_file(args.ids_file):
+                return IdStore.load(args.ids_file)
+            # Files of earlier versions are JSON objects with the ids as keys, see convert_ids_file
+            with open_input(args.ids_file) as ids_added:
+                return IdStore.from_ids(json.load(ids_added))
         except ValueError:
-            print(f"{error()} File is not a JSON file or does not contain an object.")
+            logger.error("File is not a JSON file or does not contain an object.")
             exit()
         except OSError:
-            print(f"{error()} Couldn't open {args.ids_file}. Check path file and try it again")
+            logger.error("Couldn't open %s. Check path file and try it again", args.ids_file)
             exit()
     else:
-        return {}
+        return IdStore()
+
+
+def convert_ids_file(json_filename: str, store_filename: str) -> int:
+    """
+    Converts an all_ids.json file of earlier versions into an id store file
+
+    :return: Number of ids converted
+    """
+    with open_input(json_filename) as f:
+        store = IdStore.from_ids(json.load(f))
+    store.save(store_filename)
+    return len(store)
 
 
 def program(args):
@@ -1616,11 +3638,39 @@ def program(args):
     parser.add_argument("-F", "--folder", default="-", help="Output folder")
     parser.add_argument("-r", "--resptrs_file", help="List of resptrs targets")
     parser.add_argument("-c", "--permissions_file", help="List of permission configurations")
-    parser.add_argument("-i", "--ids_file", help="List with used ids in all_ids.json")
+    parser.add_argument("-i", "--ids_file", help="Used ids, an all_ids.ids file or an all_ids.json file")
     parser.add_argument("-d", "--download", action="store_true", help="Download image files")
-    parser.add_argument("-v", "--verbose", action="store_true", help="Verbose feedback")
-
-    args = parser.parse_args()
+    parser.add_argument("--download-workers", type=int, default=4, help="Number of image files downloaded concurrently")
+    parser.add_argument("--verify-images", action="store_true",
+                        help="Checks the hash of the image files downloaded by an earlier run, not only size and time")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Verbose feedback (same as '--log-level debug')")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info", help="Minimal level of the messages")
+    parser.add_argument("--log-format", choices=["text", "json"], default="text", help="Format of the messages, json writes one object per line")
+    parser.add_argument("--log-file", help="Write the messages to this file instead of stdout")
+    parser.add_argument("--log-sample", type=int, default=1, help="Only log one in N messages per value (with -v)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of resources fetched concurrently")
+    parser.add_argument("--processes", type=int, default=0, help="Number of worker processes converting the resources")
+    parser.add_argument("--max-values", type=int, help="Maximum number of values per property (writes the CSV file without a spill file)")
+    parser.add_argument("--metrics-port", type=int, help="Serve metrics in the Prometheus format on this port")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics are served on, e.g. 0.0.0.0 for remote scraping")
+    parser.add_argument("--compress", choices=list(compressions), help="Compress the XML, CSV and JSON files")
+    parser.add_argument("--output", action="append", choices=list(output_backends), help="Also write the data as JSON lines, SQLite database or Parquet file (repeatable)")
+    parser.add_argument("--shard-size", help="Split the data XML into parts of N resources or a size like 500MB")
+    parser.add_argument("--since", help="Fingerprints file of the previous export, only changes are exported")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted export in the output folder")
+    parser.add_argument("--retries", type=int, default=5, help="Number of retries for failed requests")
+    parser.add_argument("--backoff", type=float, default=0.5, help="Backoff factor in seconds between retries")
+    parser.add_argument("--timeout", action="append", help="Read timeout per endpoint as ENDPOINT=SECONDS, e.g. 'resources=30' or 'default=60'")
+    parser.add_argument("--cache", help="Folder for caching the responses of the SALSAH API")
+    parser.add_argument("--cache-ttl", type=int, help="Seconds a cached response stays valid")
+    parser.add_argument("--cache-size", type=int, help="Maximum size of the response cache in MB")
+    parser.add_argument("--offline", action="store_true", help="Only use responses from the cache (requires --cache)")
+    parser.add_argument("--single-request", action="store_true", help="Fetch each resource with one request (label taken from the resource)")
+
+    args = parser.parse_args(args)
+
+    log_level = logging.DEBUG if args.verbose else getattr(logging, args.log_level.upper())
+    setup_logging(log_level, args.log_format, args.log_file, max(args.log_sample, 1))
 
     project = param_project(args)
     shortcode = param_shortcode(args)
@@ -1629,7 +3679,28 @@ def program(args):
     start = 0 if args.start is None else args.start
     nrows = -1 if args.nrows is None else args.nrows
     download = args.download
-    verbose = args.verbose
+
+    if args.workers < 1:
+        logger.error("The number of workers must be at least 1")
+        exit()
+
+    if args.offline and args.cache is None:
+        logger.error("The offline mode needs a response cache ('--cache FOLDER')")
+        exit()
+
+    if args.offline and download:
+        logger.error("Image files can't be downloaded in offline mode")
+        exit()
+
+    shard_size = param_shard_size(args)
+
+    if args.compress == "zstd" and zstandard is None:
+        logger.error("The zstd compression needs the package 'zstandard'")
+        exit()
+
+    if "parquet" in (args.output or []) and pyarrow is None:
+        logger.error("The parquet output needs the package 'pyarrow'")
+        exit()
 
     # Selects a parser and make it remove whitespace to discard xml file formatting
     parser = etree.XMLParser(remove_blank_text=True)
@@ -1646,80 +3717,120 @@ def program(args):
     images_path = os.path.join(folder, "images")
     outfile_path = os.path.join(folder, project)
 
-    if os.path.exists(folder):
+    if os.path.exists(folder) and not args.resume:
         delete_existing = input('Output directory already exists! Delete existing? [y/N] ')
         if delete_existing.lower() == 'y':
             shutil.rmtree(folder)
         else:
-            print(f"{log()} Exit script")
+            logger.info("Exit script")
             exit()
     try:
-        os.mkdir(folder)
-        os.mkdir(assets_path)
-        os.mkdir(images_path)
+        # Keeps the existing folders (and the journal in it) if an export is resumed
+        os.makedirs(folder, exist_ok=args.resume)
+        os.makedirs(assets_path, exist_ok=args.resume)
+        os.makedirs(images_path, exist_ok=args.resume)
     except OSError:
-        print(f"{error()} Couldn't create necessary folders")
+        logger.error("Couldn't create necessary folders")
         exit()
 
-    # Defines session
-    session = requests.Session()
-    # Skips verification (Use it only for local requests)
-    session.verify = False
+    # Defines session with one connection per worker
+    session = make_session(max(args.workers + args.download_workers, 10), args.retries, args.backoff)
+
+    # Defines the response cache and removes the expired responses
+    cache = None
+    if args.cache is not None:
+        cache_size = args.cache_size * 1024 * 1024 if args.cache_size is not None else None
+        cache = ResponseCache(args.cache, ttl=args.cache_ttl, max_size=cache_size, offline=args.offline)
+        cache.prune()
 
     # Loads ids from file if parameter given
-    global allResAdded
-    allResAdded = get_ids_from_file(args)
+    context = ExportContext(get_ids_from_file(args))
 
     con = Salsah(server=args.server, user=user, password=password, filename=outfile_path,
                  assets_path=assets_path, images_path=images_path, projectname=args.project, shortcode=shortcode,
-                 resptrs=resptrs, permissions=permissions, session=session)
+                 resptrs=resptrs, permissions=permissions, session=session, workers=args.workers,
+                 single_request=args.single_request, cache=cache, timeouts=param_timeouts(args),
+                 download_workers=args.download_workers, verify_images=args.verify_images, processes=args.processes, context=context,
+                 compression=args.compress)
+
+    # Serves the metrics while the export is running
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = serve_metrics(args.metrics_port, con, args.metrics_host)
+        logger.info("Metrics served on http://%s:%d/metrics", args.metrics_host, args.metrics_port)
 
     ##########################
     # ONTOLOGY related steps
     ##########################
 
-    print(f"{time()} Starting 'Collect ontology'...")
+    logger.info("Starting 'Collect ontology'...")
 
     # Gets the ontology of the project and stores it
     ontology = con.get_ontology()
 
-    print(f"{time()} Finished 'Collect ontology'")
+    logger.info("Finished 'Collect ontology'")
 
     # Writes the ontology to a json file
     con.write_to_json(ontology)
 
-    print(f"{time()} {success()} Ontology JSON file created")
+    logger.log(SUCCESS, "Ontology JSON file created")
 
     ########################
     # DATA related stuff
     ########################
 
-    print(f"{time()} Starting 'Collect data'...")
-
-    # Gets the data of the project and stores it
-    xml_data, csv_data = con.get_data(project, nrows, start, download, verbose)
+    logger.info("Starting 'Collect data'...")
 
-    print(f"{time()} Finished 'Collect data'")
-
-    # Writes all the data from xml_root to a xml file
-    con.write_to_xml(xml_data)
-
-    print(f"{time()} {success()} Data XML file created")
-
-    # Writes all the data from csv_data to a csv file
-    con.write_to_csv(csv_data)
-
-    print(f"{time()} {success()} Data CSV file created")
-
-    # Writes all the resource ids to a json file. So it can be used for further imports without having duplicates ids.
-    save(f"{con.projectname}-all_ids.json", allResAdded)
-
-    print(f"{time()} File with all ID's created (root folder)")
+    # Gets the data of the project and writes it to the xml and csv file
+    try:
+        con.get_data(project, nrows, start, download, args.max_values, args.resume, param_since(args),
+                     shard_size, args.output)
+    except SalsahError as err:
+        logger.error("%s", err.message)
+        logger.error("The export is incomplete. The journal %s.journal is kept, run the same command again with "
+                     "--resume to continue the export", con.filename)
+        if con.downloader is not None:
+            con.downloader.cancel()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        stop_logging()
+        sys.exit(1)
+
+    logger.info("Finished 'Collect data'")
+
+    logger.log(SUCCESS, "Data XML file created")
+
+    logger.log(SUCCESS, "Data CSV file created")
+
+    for output in dict.fromkeys(args.output or []):
+        logger.log(SUCCESS, "Data %s file created", output)
+
+    # Writes all the resource ids to an id store file. So it can be used for further imports without having
+    # duplicates ids.
+    store = context.get_store()
+    # The store loaded with -i is usually the file which is replaced
+    context.store.close()
+    store.save(f"{con.projectname}-all_ids.ids")
+
+    logger.info("File with all ID's created (root folder)")
+
+    if cache is not None:
+        cache.prune()
+        logger.info("Response cache: %d hits, %d misses", cache.hits, cache.misses)
+
+    # Writes the latencies of the requests and the metrics of the stages to json files
+    con.latency.print_summary()
+    save(f"{con.filename}-latency.json", con.latency.to_dict(), args.compress)
+    save(f"{con.filename}-metrics.json", con.metrics.to_dict(), args.compress)
+    if metrics_server is not None:
+        metrics_server.shutdown()
 
     # Writes all the resources to a json file (for debugging purposes only, it is not recommended using it for more
     # than 1'000 resources otherwise the file will get very big)
     # save(con.filename + "_all_resources.json", {"resources": resources})
 
+    stop_logging()
+
     print(f"=====================================================")
     print(f"Ontology and data files are stored in '{folder}'\n")
 
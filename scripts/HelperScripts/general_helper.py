@@ -1,16 +1,49 @@
 import copy
 import datetime
 import difflib
+import gzip
 import json
+import lzma
+import os
 import re
 import unicodedata
-from typing import Any, Generator, Union
+from typing import IO, Any, Generator, Union
 
 from lxml import etree
 
 from HelperScripts.warnings_handler import handle_warnings
 
 
+def open_maybe_compressed(path: str, mode: str = 'rt', **kwargs) -> IO:
+    '''
+    Opens a file for reading, which may be compressed with gzip, xz or zstd (as written by
+    salsah2xml.py --compress). If the file does not exist, the compressed variants with the
+    endings .gz, .xz and .zst are tried. The compression is recognized by the first bytes.
+    Kept independent of salsah2xml.py, so the helper scripts don't need its dependencies.
+    :param path: path to the (uncompressed) file
+    :param mode: 'rt' or 'rb'
+    '''
+    if not os.path.exists(path):
+        for ending in ['.gz', '.xz', '.zst']:
+            if os.path.exists(path + ending):
+                path = path + ending
+                break
+
+    with open(path, 'rb') as f:
+        head = f.read(6)
+
+    if head.startswith(b'\x1f\x8b'):
+        return gzip.open(path, mode, **kwargs)
+    if head.startswith(b'\xfd7zXZ\x00'):
+        return lzma.open(path, mode, **kwargs)
+    if head.startswith(b'\x28\xb5\x2f\xfd'):
+        import zstandard
+        return zstandard.open(path, mode, **kwargs)
+    return open(path, mode, **kwargs)
+
+
+
+
 def check_notna(string: Any) -> bool:
     return isinstance(string, str) and bool(re.search(r'\w', string))
 
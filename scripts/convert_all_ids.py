@@ -0,0 +1,30 @@
+"""
+Converts the all_ids.json file of an earlier export into an id store file, which salsah2xml.py reads with -i
+
+Usage: python scripts/convert_all_ids.py <project>-all_ids.json [<project>-all_ids.ids]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from salsah2xml import convert_ids_file
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    json_filename = sys.argv[1]
+    if len(sys.argv) > 2:
+        store_filename = sys.argv[2]
+    else:
+        store_filename = os.path.splitext(json_filename)[0] + ".ids"
+
+    n = convert_ids_file(json_filename, store_filename)
+    print(f"{n} ids written to '{store_filename}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ import pandas as pd
 from lxml import etree
 from lxml.builder import E
 
-from HelperScripts.general_helper import check_notna, find_date_in_string
+from HelperScripts.general_helper import check_notna, find_date_in_string, open_maybe_compressed
 from HelperScripts.warnings_handler import handle_warnings
 
 ##############################
@@ -835,8 +835,8 @@ def main():
 
     # general preparation
     # -------------------
-    onto_file: dict[str, Any] = json.load(open('LIMC.json'))
-    main_df = pd.read_csv('data/LIMC-3.csv', dtype='str', sep=';')
+    onto_file: dict[str, Any] = json.load(open_maybe_compressed('LIMC.json'))
+    main_df = pd.read_csv(open_maybe_compressed('data/LIMC-3.csv', encoding='utf8'), dtype='str', sep=';')
     # main_df.drop_duplicates(inplace = True)
     # main_df.dropna(how = 'all', inplace = True)
     max_prop_count = int(list(main_df)[-1].split('_')[0])
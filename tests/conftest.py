@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root_path)
+sys.path.insert(0, os.path.join(root_path, "benchmarks"))
+
+import fake_salsah
+
+
+@pytest.fixture(scope="session")
+def salsah_server():
+    """
+    Stand-in SALSAH server with a project "test" of 200 resources, see benchmarks/fake_salsah.py
+    """
+    server = fake_salsah.start_server(0, 200)
+    yield server
+    server.shutdown()
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+import pytest
+
+import salsah2xml
+from salsah2xml import ordered_map
+
+
+def test_ordered_map_keeps_order():
+    def slow_square(x: int) -> int:
+        # Later items finish first
+        time.sleep(0.001 * (20 - x % 20))
+        return x * x
+
+    items = list(range(100))
+    assert list(ordered_map(slow_square, items, workers=8)) == list(ordered_map(slow_square, items, workers=1))
+
+
+@pytest.mark.parametrize("workers,window", [(2, None), (4, 4), (8, 3), (8, 32)])
+def test_ordered_map_window(workers, window):
+    pulled = 0
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def items():
+        nonlocal pulled
+        for i in range(200):
+            pulled += 1
+            yield i
+
+    def func(x: int) -> int:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.001)
+        with lock:
+            running -= 1
+        return x
+
+    limit = window if window is not None else 2 * workers
+    for consumed, result in enumerate(ordered_map(func, items(), workers=workers, window=window)):
+        assert result == consumed
+        # Calls submitted but not yet yielded, including the one just yielded
+        assert pulled - consumed <= limit
+
+    assert max_running <= workers
+
+
+def export(server, folder: str, workers: int) -> None:
+    salsah2xml.program([server.fake.base_url, "-u", "user", "-p", "password", "-P", "test", "-s", "0001",
+                        "-F", folder, "-d", "-w", str(workers)])
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_get_data_with_workers(salsah_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    export(salsah_server, "sequential", 1)
+    export(salsah_server, "concurrent", 8)
+
+    # The image paths contain the output folder
+    for name in ["test.xml", "test.csv", "test.json"]:
+        sequential = read(os.path.join("sequential", name)).replace(b"sequential/", b"concurrent/")
+        assert sequential == read(os.path.join("concurrent", name)), name
+
+    images = sorted(os.listdir(os.path.join("sequential", "images")))
+    assert len(images) > 0
+    assert images == sorted(os.listdir(os.path.join("concurrent", "images")))
+    for name in images:
+        assert read(os.path.join("sequential", "images", name)) == read(os.path.join("concurrent", "images", name))
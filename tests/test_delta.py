@@ -0,0 +1,35 @@
+import json
+import os
+
+import salsah2xml
+
+
+def export(server, folder: str, *options: str) -> None:
+    salsah2xml.program([server.fake.base_url, "-u", "user", "-p", "password", "-P", "test", "-s", "0001",
+                        "-F", folder] + list(options))
+
+
+def count_resources(filename: str) -> int:
+    with open(filename, encoding="utf-8") as f:
+        return f.read().count("<resource ")
+
+
+def test_changed_resources_pass_the_id_store(salsah_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    export(salsah_server, "full")
+    assert os.path.exists("test-all_ids.ids")
+
+    # Marks three resources as changed since the previous export
+    with open(os.path.join("full", "test-fingerprints.json")) as f:
+        fingerprints = json.load(f)
+    for res_id in ["3", "50", "120"]:
+        fingerprints[res_id] = "changed"
+    with open("fingerprints.json", "w") as f:
+        json.dump(fingerprints, f)
+
+    export(salsah_server, "delta", "--since", "fingerprints.json")
+    assert count_resources(os.path.join("delta", "test.xml")) == 3
+
+    # The ids of the previous export are passed back, the changed resources are exported anyway
+    export(salsah_server, "delta_ids", "--since", "fingerprints.json", "-i", "test-all_ids.ids")
+    assert count_resources(os.path.join("delta_ids", "test.xml")) == 3
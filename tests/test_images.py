@@ -0,0 +1,44 @@
+import os
+
+import requests
+
+import salsah2xml
+
+
+def download(salsah_server, manifest: str, paths, verify: bool = False) -> salsah2xml.ImageDownloader:
+    session = requests.Session()
+    downloader = salsah2xml.ImageDownloader(lambda url, method="GET", **kwargs: session.request(method, url, **kwargs),
+                                            2, manifest, verify=verify)
+    for res_id, path in paths.items():
+        downloader.submit(f"{salsah_server.fake.base_url}/img/{res_id}?qtype=full", path)
+    downloader.close()
+    return downloader
+
+
+def test_complete_images_are_skipped_without_hashing(salsah_server, tmp_path, monkeypatch):
+    manifest = str(tmp_path / "images.jsonl")
+    paths = {res_id: str(tmp_path / f"img{res_id}.jpg") for res_id in [5, 10, 15]}
+    assert download(salsah_server, manifest, paths).counts["downloaded"] == 3
+
+    # Size and modification time match the manifest, the files are not read again
+    hashed = []
+    get_hash = salsah2xml.ImageDownloader.get_hash
+    monkeypatch.setattr(salsah2xml.ImageDownloader, "get_hash",
+                        lambda self, path: hashed.append(path) or get_hash(self, path))
+    assert download(salsah_server, manifest, paths).counts["skipped"] == 3
+    assert hashed == []
+
+    # A file changed in place has the same size but another modification time, its hash is checked
+    with open(paths[10], "r+b") as f:
+        f.write(b"\x00" * 16)
+    stat = os.stat(paths[10])
+    os.utime(paths[10], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    downloader = download(salsah_server, manifest, paths)
+    assert downloader.counts == {"downloaded": 1, "resumed": 0, "skipped": 2, "failed": 0}
+    assert hashed == [paths[10]]
+
+    # The verify mode hashes every file
+    hashed.clear()
+    assert download(salsah_server, manifest, paths, verify=True).counts["skipped"] == 3
+    assert sorted(hashed) == sorted(paths.values())
+    assert os.path.getsize(paths[10]) == salsah_server.fake.image_size
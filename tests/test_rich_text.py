@@ -0,0 +1,135 @@
+import json
+import random
+from typing import Dict, List
+
+import pytest
+
+from salsah2xml import SalsahError, etags, process_rich_text, stags
+
+
+def reference_process_rich_text(utf8str: str, projectname: str, textattr: str = None, resptrs: List = []) -> (str, str):
+    """
+    process_rich_text as it was before the one-pass rewrite, the output of the current version has to match it
+    """
+    if textattr is not None and textattr != "{}":
+
+        attributes = json.loads(textattr)
+        if len(attributes) == 0:
+            return "utf8", utf8str
+
+        attrlist: List = []
+
+        for key, vals in attributes.items():
+            for val in vals:
+                attr: Dict = {
+                    "tagname": key,
+                    "type": "start",
+                    "pos": int(val["start"])
+                }
+
+                if val.get("href"):
+                    attr["href"] = val["href"].replace("\"", "'")
+                if val.get("resid"):
+                    attr["resid"] = val["resid"]
+                if val.get("style"):
+                    attr["style"] = val["style"]
+
+                attrlist.append(attr)
+                attr = {
+                    "tagname": key,
+                    "type": "end",
+                    "pos": val["end"]
+                }
+                attrlist.append(attr)
+
+        attrlist = sorted(attrlist, key=lambda attr: attr["pos"])
+        pos: int = 0
+        result: str = ""
+        stack: List = []
+
+        for attr in attrlist:
+            result += utf8str[pos:attr["pos"]].replace("<", "").replace(">", "")
+            if attr["type"] == "start":
+                if attr["tagname"] == "_link":
+                    if attr.get("resid") is not None:
+                        result += stags[attr["tagname"]][1].format(projectname + "_" + attr["resid"])
+                    elif attr.get("href") is not None:
+                        result += stags[attr["tagname"]][0].format(attr["href"])
+                    else:
+                        result += stags[attr["tagname"]][2]
+                else:
+                    result += stags[attr["tagname"]]
+                stack.append(attr)
+            elif attr["type"] == "end":
+                match = False
+                tmpstack: List = []
+                while True:
+                    tmp = stack.pop()
+                    result += etags[tmp["tagname"]]
+                    if tmp["tagname"] == attr["tagname"] and tmp["type"] == "start":
+                        match = True
+                        break
+                    else:
+                        tmpstack.append(tmp)
+                while len(tmpstack) > 0:
+                    tmp = tmpstack.pop()
+                    check_list = stags[tmp["tagname"]]
+                    if isinstance(check_list, list):
+                        if tmp.get("resid") is not None:
+                            result += check_list[1].format(projectname + "_" + tmp["resid"])
+                        elif tmp.get("href") is not None:
+                            result += check_list[0].format(tmp["href"])
+                        else:
+                            result += check_list[2]
+                    else:
+                        result += check_list
+
+                    stack.append(tmp)
+            pos = attr["pos"]
+        return "xml", result
+    else:
+        # Not the best solution. All "<" and ">" are eliminated so at the end it is valid
+        return "xml", utf8str.replace("<", "").replace(">", "")
+
+
+def random_text(rnd: random.Random) -> str:
+    words = ["alpha", "Beta", "<b>", "a > b", "&amp;", "\"quoted\"", "Ünïcödé", "\n", " ", "x"]
+    return "".join(rnd.choice(words) for _ in range(rnd.randint(0, 30)))
+
+
+def random_attributes(rnd: random.Random, length: int) -> Dict:
+    attributes: Dict = {}
+    for _ in range(rnd.randint(0, 6)):
+        tagname = rnd.choice(list(stags))
+        start = rnd.randint(0, length + 2)
+        val: Dict = {"start": start, "end": rnd.randint(start, length + 2)}
+        if tagname == "_link":
+            kind = rnd.choice(["resid", "href", None])
+            if kind == "resid":
+                val["resid"] = str(rnd.randint(1, 10000))
+            elif kind == "href":
+                val["href"] = rnd.choice(["http://example.org/?a=\"1\"", "https://dasch.swiss"])
+        if rnd.random() < 0.1:
+            val["style"] = "color: red"
+        # Positions arrive as strings or numbers
+        if rnd.random() < 0.3:
+            val["start"] = str(val["start"])
+        attributes.setdefault(tagname, []).append(val)
+    return attributes
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_process_rich_text_matches_reference(seed):
+    rnd = random.Random(seed)
+    for _ in range(500):
+        text = random_text(rnd)
+        textattr = rnd.choice([None, "{}", json.dumps(random_attributes(rnd, len(text)))])
+        assert process_rich_text(text, "test", textattr) == reference_process_rich_text(text, "test", textattr)
+
+
+def test_process_rich_text_end_without_start():
+    textattr = json.dumps({"bold": [{"start": 5, "end": 2}]})
+    with pytest.raises(IndexError):
+        reference_process_rich_text("some text", "test", textattr)
+    with pytest.raises(SalsahError):
+        process_rich_text("some text", "test", textattr)